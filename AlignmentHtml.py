@@ -0,0 +1,113 @@
+#!/usr/bin/python3
+"""Render alignments as HTML in the style of mview.
+
+The residues are coloured like with 'mview -colormap CLUSTAL -coloring any
+-bold', with a CLUSTAL conservation line below the alignment. Runs of
+residues with the same colour share one span, so large alignments stay small.
+"""
+
+import html
+import shutil
+from functools import lru_cache
+from itertools import groupby
+
+# Colour of the residues in the CLUSTAL colormap, by residue groups.
+CLUSTAL_GROUPS = (
+    ("ACFILMVW", "#80a0f0"),
+    ("KR", "#f01505"),
+    ("DE", "#c048c0"),
+    ("NQST", "#15c015"),
+    ("G", "#f09048"),
+    ("P", "#c0c000"),
+    ("HY", "#15a4a4"),
+    ("U", "#15c015"),
+)
+CLUSTAL_COLORS = {
+    residue: color
+    for residues, color in CLUSTAL_GROUPS
+    for residue in residues + residues.lower()
+}
+
+# Groups for the conservation line, ':' if a column is within a strong group,
+# '.' if it is within a weak group.
+STRONG_GROUPS = ("STA", "NEQK", "NHQK", "NDEQ", "QHRK", "MILV", "MILF", "HY", "FYW")
+WEAK_GROUPS = (
+    "CSA", "ATV", "SAG", "STNK", "STPA", "SGND", "SNDEQK", "NDEQHK", "NEQHRK", "FVLIM", "HFY",
+)
+
+STYLE = "pre.alignment {font-family: monospace; line-height: 1.2;}"
+
+
+@lru_cache(maxsize=None)
+def mview_available():
+    """Check once if mview is installed."""
+    return shutil.which("mview") is not None
+
+
+@lru_cache(maxsize=None)
+def column_symbol(residues):
+    """Get the CLUSTAL conservation symbol of a column.
+
+    :param frozenset residues: The upper case residues of the column.
+    """
+    if "-" in residues or "." in residues:
+        return " "
+    if len(residues) == 1:
+        return "*"
+    if any(residues.issubset(group) for group in STRONG_GROUPS):
+        return ":"
+    if any(residues.issubset(group) for group in WEAK_GROUPS):
+        return "."
+    return " "
+
+
+def conservation_line(sequences):
+    """Get the CLUSTAL conservation symbol of every column.
+
+    '*' for identical residues, ':' and '.' for residues in a strong or weak
+    group, ' ' else or if a sequence has a gap.
+    """
+    upper = [sequence.upper() for sequence in sequences]
+    return "".join(column_symbol(frozenset(column)) for column in zip(*upper))
+
+
+def color_sequence(sequence):
+    """Get a sequence as HTML, residues coloured by CLUSTAL_COLORS."""
+    parts = []
+    for color, residues in groupby(sequence, key=CLUSTAL_COLORS.get):
+        residues = "".join(residues)
+        if color is None:
+            parts.append(html.escape(residues))
+        else:
+            parts.append(f'<span style="color:{color}">{residues}</span>')
+    return "".join(parts)
+
+
+def render_alignment(labels, sequences, title=None):
+    """Render one alignment as HTML fragment.
+
+    :param list labels: Label of every sequence.
+    :param list sequences: Aligned sequences, all of the same length.
+    :param str title: Heading above the alignment, none if not given.
+    :rtype: str
+    """
+    width = max((len(label) for label in labels), default=0) + 2
+    lines = [
+        f"<strong>{html.escape(label.ljust(width))}</strong>"
+        f"<strong>{color_sequence(sequence)}</strong>"
+        for label, sequence in zip(labels, sequences)
+    ]
+    lines.append(" " * width + conservation_line(sequences))
+    heading = f"<h3>{html.escape(title)}</h3>\n" if title else ""
+    return heading + '<pre class="alignment">\n' + "\n".join(lines) + "\n</pre>\n"
+
+
+def render_document(fragments, title="Alignments"):
+    """Put HTML fragments of render_alignment() into one HTML document."""
+    return (
+        "<!DOCTYPE html>\n<html>\n<head>\n"
+        f'<meta charset="UTF-8">\n<title>{html.escape(title)}</title>\n'
+        f"<style>{STYLE}</style>\n</head>\n<body>\n"
+        + "".join(fragments)
+        + "</body>\n</html>\n"
+    )
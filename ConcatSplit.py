@@ -65,7 +65,7 @@ def concat_and_split():
                     if str(e) == "Maf block self and other are not continuous":
                         if (
                             maf.size() - 1 < MIN_SIZE
-                            and len(maf.block[1][-1].replace("-", "")) < MIN_LENGTH
+                            and maf.len_no_gaps() < MIN_LENGTH
                         ):
                             maf = next_maf
                             next_maf = MafBlock()
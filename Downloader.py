@@ -0,0 +1,196 @@
+#!/usr/bin/python3
+"""Download files over FTP or HTTP concurrently.
+
+Files are written to '<file>.part' first. An interrupted download is resumed
+from the end of the part file with a range request (REST for FTP), the md5
+checksum is computed while streaming.
+"""
+
+import ftplib
+import hashlib
+import json
+import os
+import time
+import urllib.error
+import urllib.request
+from concurrent.futures import ThreadPoolExecutor
+from contextlib import contextmanager
+from http.client import HTTPException
+from urllib.parse import urlparse
+
+CHUNK_SIZE = 1 << 20
+# Number of connections before a download is given up.
+MAX_TRIES = 5
+# Seconds to wait after a failed connection, doubled each time.
+RETRY_WAIT = 5
+TIMEOUT = 60
+NUM_DOWNLOADS = 4
+
+# Errors after which a download is resumed.
+CONNECTION_ERRORS = (OSError, EOFError, HTTPException, ftplib.Error)
+# HTTP status codes after which a download is tried again, other client
+# errors like 404 fail at once.
+RETRY_HTTP_CODES = {408, 429} | set(range(500, 600))
+
+
+def file_md5(file_path):
+    """Get md5 checksum of a file."""
+    md5 = hashlib.md5()
+    with open(file_path, "rb") as f_handle:
+        for chunk in iter(lambda: f_handle.read(CHUNK_SIZE), b""):
+            md5.update(chunk)
+    return md5.hexdigest()
+
+
+class ChecksumCache:
+    """Verified md5 checksums of files, kept in a json file.
+
+    A checksum is reused as long as size, modification time and inode of the
+    file are the same as when it was computed.
+    """
+
+    def __init__(self, cache_path):
+        """Load cache, empty if cache_path does not exist."""
+        self.cache_path = cache_path
+        self.checksums = {}
+        if os.path.isfile(cache_path):
+            with open(cache_path, "r", encoding="UTF-8") as f_handle:
+                self.checksums = json.load(f_handle)
+
+    @staticmethod
+    def _file_state(file_path):
+        """Get size, modification time and inode of a file."""
+        stat = os.stat(file_path)
+        return [stat.st_size, stat.st_mtime_ns, stat.st_ino]
+
+    def get_md5(self, file_path, verify=False):
+        """Get md5 checksum of a file, computed only if the file changed.
+
+        :param bool verify: Compute checksum even if the file did not change.
+        """
+        key = os.path.abspath(file_path)
+        file_state = self._file_state(file_path)
+        if not verify and key in self.checksums and self.checksums[key][:3] == file_state:
+            return self.checksums[key][3]
+        md5 = file_md5(file_path)
+        self.checksums[key] = file_state + [md5]
+        return md5
+
+    def add(self, file_path, md5):
+        """Add the verified checksum of a file."""
+        self.checksums[os.path.abspath(file_path)] = self._file_state(file_path) + [md5]
+
+    def remove(self, file_path):
+        """Remove the checksum of a file."""
+        self.checksums.pop(os.path.abspath(file_path), None)
+
+    def save(self):
+        """Write cache through a temporary file."""
+        with open(self.cache_path + ".tmp", "w", encoding="UTF-8") as f_handle:
+            json.dump(self.checksums, f_handle)
+        os.replace(self.cache_path + ".tmp", self.cache_path)
+
+
+@contextmanager
+def open_url(url, off_set=0):
+    """Open url for reading from off_set.
+
+    :return: Stream, if the server starts at off_set, else it starts at 0,
+        and size of the file, None if unknown.
+    :rtype: tuple
+    """
+    parsed_url = urlparse(url)
+    if parsed_url.scheme == "ftp":
+        with ftplib.FTP(parsed_url.hostname, timeout=TIMEOUT) as ftp:
+            ftp.login()
+            ftp.voidcmd("TYPE I")
+            file_size = ftp.size(parsed_url.path)
+            with ftp.transfercmd(f"RETR {parsed_url.path}", rest=off_set or None) as conn:
+                with conn.makefile("rb") as stream:
+                    yield stream, True, file_size
+            ftp.voidresp()
+    else:
+        request = urllib.request.Request(url)
+        if off_set:
+            request.add_header("Range", f"bytes={off_set}-")
+        with urllib.request.urlopen(request, timeout=TIMEOUT) as response:
+            resumed = response.status == 206
+            file_size = response.headers.get("Content-Length")
+            if file_size is not None:
+                file_size = int(file_size) + (off_set if resumed else 0)
+            yield response, resumed, file_size
+
+
+def download_file(url, file_path, checksum=None, max_tries=MAX_TRIES):
+    """Download url to file_path, resume if the connection breaks.
+
+    :param str checksum: Expected md5 checksum, not checked if None.
+    :return: The md5 checksum.
+    :rtype: str
+    :raise: ValueError if the checksum does not match, the part file is
+        deleted then. ConnectionError if all tries failed, or at once for an
+        HTTP status that is not in RETRY_HTTP_CODES.
+    """
+    part_path = file_path + ".part"
+    md5 = hashlib.md5()
+    off_set = 0
+    if os.path.isfile(part_path):
+        with open(part_path, "rb") as f_handle:
+            for chunk in iter(lambda: f_handle.read(CHUNK_SIZE), b""):
+                md5.update(chunk)
+                off_set += len(chunk)
+
+    for tries in range(max_tries):
+        try:
+            with open_url(url, off_set) as (stream, resumed, file_size):
+                if not resumed:
+                    md5 = hashlib.md5()
+                    off_set = 0
+                with open(part_path, "r+b" if os.path.isfile(part_path) else "wb") as f_handle:
+                    f_handle.seek(off_set)
+                    f_handle.truncate()
+                    for chunk in iter(lambda: stream.read(CHUNK_SIZE), b""):
+                        f_handle.write(chunk)
+                        md5.update(chunk)
+                        off_set += len(chunk)
+            if file_size is not None and off_set < file_size:
+                raise EOFError(f"Connection closed after {off_set} of {file_size} bytes")
+            break
+        except urllib.error.HTTPError as error:
+            # The part file is already complete
+            if error.code == 416:
+                break
+            if error.code not in RETRY_HTTP_CODES or tries == max_tries - 1:
+                raise ConnectionError(f"Downloading {url} failed: {error}") from error
+        except CONNECTION_ERRORS as error:
+            if tries == max_tries - 1:
+                raise ConnectionError(f"Downloading {url} failed: {error}") from error
+        time.sleep(RETRY_WAIT * 2**tries)
+
+    if checksum is not None and md5.hexdigest() != checksum:
+        os.remove(part_path)
+        raise ValueError(f"{os.path.basename(file_path)} corupt!")
+    os.replace(part_path, file_path)
+    return md5.hexdigest()
+
+
+def download_files(downloads, num_downloads=NUM_DOWNLOADS):
+    """Download files concurrently.
+
+    :param list downloads: Url, file path and md5 checksum of each file.
+    :return: Exception of each failed download by file path.
+    :rtype: dict
+    """
+    failed = {}
+    with ThreadPoolExecutor(max_workers=num_downloads) as executor:
+        futures = {
+            executor.submit(download_file, url, file_path, checksum): file_path
+            for url, file_path, checksum in downloads
+        }
+        for future, file_path in futures.items():
+            try:
+                future.result()
+                print(f"{os.path.basename(file_path)} downloaded.", flush=True)
+            except (ConnectionError, ValueError) as error:
+                failed[file_path] = error
+    return failed
@@ -0,0 +1,151 @@
+#!/usr/bin/python3
+"""Genome wide store of the p value of each HSS id.
+
+The store is a directory of numpy files that are memory mapped on opening:
+the 64 bit hashes of the ids in sorted order, the p values, and the ids
+themselves as one byte string with offsets, to rule out hash collisions.
+Lookups are binary searches over the hashes.
+"""
+
+import hashlib
+import os
+
+import numpy as np
+
+STORE_FILES = ("hashes", "p_vals", "offsets", "ids")
+
+
+def hash_hss_id(hss_id):
+    """Get 64 bit hash of a HSS id."""
+    return int.from_bytes(
+        hashlib.blake2b(hss_id.encode("UTF-8"), digest_size=8).digest(), "little"
+    )
+
+
+class HssScoreStore:
+    """Read only mapping from HSS id to p value."""
+
+    def __init__(self, store_path):
+        """Open store.
+
+        :param str store_path: Directory written by HssScoreStore.write().
+        """
+        self.store_path = store_path
+        self.hashes, self.p_vals, self.offsets, self.ids = [
+            np.load(os.path.join(store_path, f"{name}.npy"), mmap_mode="r")
+            for name in STORE_FILES
+        ]
+
+    @staticmethod
+    def write(store_path, hss_score_dic):
+        """Write a store from a dictionary of HSS id to p value.
+
+        The files are written into a temporary directory that replaces
+        store_path at the end.
+        """
+        hss_ids = list(hss_score_dic)
+        hashes = np.array([hash_hss_id(hss_id) for hss_id in hss_ids], dtype=np.uint64)
+        order = np.argsort(hashes, kind="stable")
+        encoded_ids = [hss_ids[i].encode("UTF-8") for i in order]
+        offsets = np.zeros(len(encoded_ids) + 1, dtype=np.int64)
+        np.cumsum([len(hss_id) for hss_id in encoded_ids], out=offsets[1:])
+        arrays = {
+            "hashes": hashes[order],
+            "p_vals": np.array([float(hss_score_dic[hss_ids[i]]) for i in order]),
+            "offsets": offsets,
+            "ids": np.frombuffer(b"".join(encoded_ids), dtype=np.uint8),
+        }
+
+        tmp_path = store_path.rstrip("/") + ".tmp"
+        if not os.path.isdir(tmp_path):
+            os.mkdir(tmp_path)
+        for name in STORE_FILES:
+            np.save(os.path.join(tmp_path, f"{name}.npy"), arrays[name])
+        if os.path.isdir(store_path):
+            for name in STORE_FILES:
+                os.remove(os.path.join(store_path, f"{name}.npy"))
+            os.rmdir(store_path)
+        os.replace(tmp_path, store_path)
+
+    def __len__(self):
+        """Get number of HSS ids."""
+        return len(self.hashes)
+
+    def _get_id(self, i):
+        """Get id at position i."""
+        return self.ids[self.offsets[i]:self.offsets[i + 1]].tobytes().decode("UTF-8")
+
+    def _find(self, hss_id, hss_hash, left):
+        """Get position of hss_id, starting at the first position with its hash.
+
+        :return: Position or -1 if the id is not in the store.
+        :rtype: int
+        """
+        i = left
+        while i < len(self.hashes) and self.hashes[i] == hss_hash:
+            if self._get_id(i) == hss_id:
+                return i
+            i += 1
+        return -1
+
+    def _position(self, hss_id):
+        """Get position of hss_id, -1 if it is not in the store."""
+        hss_hash = np.uint64(hash_hss_id(hss_id))
+        return self._find(hss_id, hss_hash, int(np.searchsorted(self.hashes, hss_hash)))
+
+    def __contains__(self, hss_id):
+        """Check if HSS id is in store."""
+        return self._position(hss_id) != -1
+
+    def __getitem__(self, hss_id):
+        """Get p value of HSS id.
+
+        :raise: KeyError if the id is not in the store.
+        """
+        i = self._position(hss_id)
+        if i == -1:
+            raise KeyError(hss_id)
+        return float(self.p_vals[i])
+
+    def get_many(self, hss_ids):
+        """Get p values of many HSS ids at once.
+
+        The hashes of all ids are searched in one np.searchsorted and the ids
+        at the found positions are compared in one go. Only ids that do not
+        match there, a hash collision or a missing id, are looked up one by
+        one.
+
+        :raise: KeyError if an id is not in the store.
+        :rtype: numpy.ndarray
+        """
+        hss_ids = list(hss_ids)
+        encoded_ids = [hss_id.encode("UTF-8") for hss_id in hss_ids]
+        hashes = np.array([hash_hss_id(hss_id) for hss_id in hss_ids], dtype=np.uint64)
+        lengths = np.array([len(hss_id) for hss_id in encoded_ids], dtype=np.int64)
+        positions = np.searchsorted(self.hashes, hashes).astype(np.int64)
+
+        # Candidates have the hash and the length of the id at their position
+        candidates = np.flatnonzero(positions < len(self.hashes))
+        candidates = candidates[self.hashes[positions[candidates]] == hashes[candidates]]
+        starts = self.offsets[positions[candidates]]
+        same_length = self.offsets[positions[candidates] + 1] - starts == lengths[candidates]
+        candidates, starts = candidates[same_length], starts[same_length]
+
+        # Compare the bytes of all candidate ids at once
+        candidate_lengths = lengths[candidates]
+        bounds = np.zeros(len(candidates) + 1, dtype=np.int64)
+        np.cumsum(candidate_lengths, out=bounds[1:])
+        query = np.frombuffer(b"".join(encoded_ids[j] for j in candidates.tolist()), dtype=np.uint8)
+        stored = self.ids[
+            np.repeat(starts - bounds[:-1], candidate_lengths) + np.arange(bounds[-1])
+        ]
+        num_diffs = np.zeros(len(query) + 1, dtype=np.int64)
+        np.cumsum(stored != query, out=num_diffs[1:])
+        matched = np.zeros(len(hss_ids), dtype=bool)
+        matched[candidates] = num_diffs[bounds[1:]] == num_diffs[bounds[:-1]]
+
+        for j in np.flatnonzero(~matched).tolist():
+            positions[j] = self._find(hss_ids[j], hashes[j], int(positions[j]))
+            if positions[j] == -1:
+                raise KeyError(hss_ids[j])
+        return np.asarray(self.p_vals[positions])
@@ -2,11 +2,115 @@
 """Python module for class MafBlock."""
 
 
-from copy import deepcopy
+import sys
+import os
 import subprocess
 import gzip
-import re
-from collections import defaultdict
+import tempfile
+from array import array
+from bisect import bisect_right
+from collections import OrderedDict, defaultdict, deque
+from contextlib import contextmanager
+
+import numpy as np
+
+from AlignmentHtml import mview_available, render_alignment, render_document
+
+
+GAP = ord("-")
+# Gaps and undefined nucleotides by byte value, see percent_undefined().
+UNDEFINED = np.zeros(256, dtype=bool)
+UNDEFINED[list(b"Nn-")] = True
+# Rows of a cleaned maf block must have less undefined positions in percent.
+MAX_UNDEFINED = 95
+# Bytes read at once from a (compressed) maf file.
+READ_CHUNK_SIZE = 1 << 22
+# Interned species names by their raw bytes, shared by all blocks.
+SPECIES_NAMES = {}
+# Maximal distance of two continuous blocks, see MafBlock.is_continuous_with.
+ALLOWED_DIST = 12
+# Uncompressed bytes between two checkpoints of a MafIndex.
+CHECKPOINT_SIZE = 1 << 20
+# Raw blocks kept for the look ahead of MafStream.concat_blocks().
+LOOKAHEAD_SIZE = 4096
+# Concatenated blocks from the look ahead kept by MafStream.concat_blocks(),
+# at most MEMO_SIZE blocks and MEMO_BYTES bytes of alignment.
+MEMO_SIZE = 256
+MEMO_BYTES = 64 << 20
+
+
+def int_array(values):
+    """Convert numpy integers to an array("q")."""
+    result = array("q")
+    result.frombytes(np.asarray(values, dtype=np.int64).tobytes())
+    return result
+
+
+def intern_species_name(raw_name):
+    """Intern a species name given as bytes."""
+    return SPECIES_NAMES.setdefault(raw_name, sys.intern(raw_name.decode("ascii")))
+
+
+def raw_block_coordinates(raw_block):
+    """Return start and end of the target of a raw maf block without parsing it."""
+    if raw_block.startswith(b"s"):
+        line_start = 0
+    else:
+        line_start = raw_block.find(b"\ns") + 1
+        if line_start == 0:
+            return -1, -1
+    fields = raw_block[line_start : raw_block.find(b"\n", line_start)].split(None, 4)
+    start = int(fields[2])
+    return start, start + int(fields[3])
+
+
+def split_raw_blocks(maf_handle, block_index=0, off_set=0):
+    """Cut the maf text read from a binary handle into raw blocks.
+
+    The handle is read in large chunks and cut at the empty lines that end a
+    block, nothing is decoded or parsed. Yields the block index, the offset
+    of the block and the bytes of the block without the empty line.
+
+    :param maf_handle: binary file handle positioned at a block start.
+    :param int block_index: Index of the block at the handle position.
+    :param int off_set: Offset of the block at the handle position.
+    """
+    buffer = b""
+    pos = 0
+    while True:
+        chunk = maf_handle.read(READ_CHUNK_SIZE)
+        # EOF, a block without closing empty line is not yielded
+        if not chunk:
+            break
+        buffer = buffer[pos:] + chunk
+        pos = 0
+        while True:
+            # Empty line right at the start is an empty block
+            if buffer.startswith(b"\n", pos):
+                end = pos
+            else:
+                end = buffer.find(b"\n\n", pos)
+                if end == -1:
+                    break
+                end += 1
+            yield block_index, off_set, buffer[pos:end]
+            off_set += end + 1 - pos
+            pos = end + 1
+            block_index += 1
+
+
+def write_html(maf_blocks, html_file_path, names=None, title="Alignments"):
+    """Render a batch of maf blocks into one HTML document.
+
+    :param list maf_blocks: The maf blocks, in order of the document.
+    :param list names: Heading of each block, none if None.
+    """
+    if names is None:
+        names = [None] * len(maf_blocks)
+    fragments = [maf.to_html(name) for maf, name in zip(maf_blocks, names)]
+    with open(html_file_path + ".tmp", "w", encoding="UTF-8") as f_handle:
+        f_handle.write(render_document(fragments, title))
+    os.replace(html_file_path + ".tmp", html_file_path)
 
 
 def append_html(string, name):
@@ -19,15 +123,40 @@ def append_html(string, name):
 
 def percent_undefined(string):
     """Calculate the percentage of gaps and undefined nucs (X)."""
-    return (len(re.findall("[Nn-]", string)) / len(string)) * 100
+    return ((string.count("N") + string.count("n") + string.count("-")) / len(string)) * 100
+
+
+def percent_undefined_rows(seqs):
+    """Calculate the percentage of gaps and undefined nucs of every row of an alignment matrix."""
+    return np.count_nonzero(UNDEFINED[seqs], axis=1) / seqs.shape[1] * 100
 
 
 class MafBlock:
-    """A maf block."""
+    """A maf block.
 
-    def __init__(self, lines=None, allowed_dist=12):
+    The block is stored column wise instead of a list of split lines. Species
+    names are interned, start, size and source size are integer arrays, the
+    strands a byte array and the alignment one 2-D byte matrix (rows are
+    species, columns are alignment positions). Row 0 is the target.
+    """
+
+    def __init__(self, lines=None, allowed_dist=ALLOWED_DIST):
         """Construct class."""
-        self.block = []
+        self.header = None
+        self.names = []
+        # Species name to row, first row wins like in a linear scan.
+        self._index = {}
+        self.starts = array("q")
+        self.sizes = array("q")
+        self.strands = bytearray()
+        self.src_sizes = array("q")
+        self._seqs = np.empty((0, 0), dtype=np.uint8)
+        # Cumulative gap count per row, see _gap_index()
+        self._gap_counts = None
+        # Rows not yet merged into the matrix. Parsed rows wait here until the
+        # matrix is first needed and concat() grows them in place, so a chain
+        # of concatenations is materialised only once.
+        self._row_buffers = []
         self.allowed_dist = allowed_dist
         self.block_index_list = []
         if lines:
@@ -39,8 +168,45 @@ class MafBlock:
             self.__add_string(lines)
         elif isinstance(lines, list):
             self.__add_list(lines)
+        elif isinstance(lines, (bytes, bytearray)):
+            self.__add_bytes(lines)
+        else:
+            raise TypeError("Lines is not a string, bytes nor a list.")
+
+    def __add_bytes(self, lines):
+        """Add a raw block as read from the file, all rows at once."""
+        lines = lines.split(b"\n")
+        for line in lines:
+            if line[:1] == b"a":
+                self.header = b" ".join(line.split()).decode("ascii")
+        s_lines = [line for line in lines if line[:1] == b"s"]
+        if not s_lines:
+            return
+        # Split all rows at once, every s line has seven fields
+        fields = b" ".join(s_lines).split()
+        if len(fields) != 7 * len(s_lines):
+            raise ValueError("Maf s line does not have seven fields.")
+        names = fields[1::7]
+        starts = fields[2::7]
+        sizes = fields[3::7]
+        strands = fields[4::7]
+        src_sizes = fields[5::7]
+        sequences = fields[6::7]
+        names = [
+            SPECIES_NAMES.get(name) or intern_species_name(name) for name in names
+        ]
+        if self.names:
+            for row, name in enumerate(names, len(self.names)):
+                self._index.setdefault(name, row)
         else:
-            raise TypeError("Lines is not a string nor a list.")
+            # Reversed, so the first row of a name wins
+            self._index = dict(zip(reversed(names), range(len(names) - 1, -1, -1)))
+        self.names += names
+        self.starts.extend(map(int, starts))
+        self.sizes.extend(map(int, sizes))
+        self.strands += b"".join(strands)
+        self.src_sizes.extend(map(int, src_sizes))
+        self._row_buffers.extend(sequences)
 
     def __add_string(self, lines):
         if "\n" in lines:
@@ -49,19 +215,148 @@ class MafBlock:
                     continue
                 if entry[0] not in ["s", "a"]:
                     continue
-                self.block.append(entry.split())
+                self.__add_list(entry.split())
         else:
             if lines[0] in ["s", "a"]:
-                self.block.append(lines.split())
+                self.__add_list(lines.split())
 
     def __add_list(self, lines):
-        self.block.append(lines)
+        if lines[0] == "a":
+            self.header = " ".join(lines)
+            return
+        _maf_type, name, start, size, strand, src_size, sequence = lines
+        self._add_row(
+            name,
+            int(start),
+            int(size),
+            strand,
+            int(src_size),
+            sequence.encode("ascii") if isinstance(sequence, str) else sequence,
+        )
+
+    def _add_row(self, name, start, size, strand, src_size, sequence):
+        name = sys.intern(name)
+        self._index.setdefault(name, len(self.names))
+        self.names.append(name)
+        self.starts.append(start)
+        self.sizes.append(size)
+        self.strands.append(ord(strand))
+        self.src_sizes.append(src_size)
+        self._row_buffers.append(sequence)
+
+    def _sequences(self):
+        """Get the alignment matrix, merging the row buffers into it."""
+        if self._row_buffers:
+            width = len(self._row_buffers[0])
+            if any(len(row) != width for row in self._row_buffers) or (
+                self._seqs.shape[0] != 0 and self._seqs.shape[1] != width
+            ):
+                raise ValueError("Sequences of maf block differ in length.")
+            new_rows = np.frombuffer(
+                bytearray(b"".join(self._row_buffers)), dtype=np.uint8
+            ).reshape(len(self._row_buffers), width)
+            if self._seqs.shape[0] == 0:
+                self._seqs = new_rows
+            else:
+                self._seqs = np.vstack((self._seqs, new_rows))
+            self._row_buffers = []
+            self._gap_counts = None
+        return self._seqs
+
+    def _build_index(self):
+        self._index = {}
+        for row, name in enumerate(self.names):
+            self._index.setdefault(name, row)
+
+    def _set_sequences(self, seqs):
+        self._row_buffers = []
+        self._seqs = seqs
+        self._gap_counts = None
+
+    def _gap_index(self):
+        """Get the number of gaps before each column for every row.
+
+        Build once per alignment, the number of gaps of row r in the columns
+        [i, j) is gap_counts[r, j] - gap_counts[r, i].
+        """
+        if self._gap_counts is None:
+            seqs = self._sequences()
+            self._gap_counts = np.zeros(
+                (seqs.shape[0], seqs.shape[1] + 1), dtype=np.int64
+            )
+            np.cumsum(seqs == GAP, axis=1, out=self._gap_counts[:, 1:])
+        return self._gap_counts
+
+    def _get_row_bytes(self, row):
+        num_matrix_rows = self._seqs.shape[0]
+        if row < num_matrix_rows:
+            return self._seqs[row].tobytes()
+        return self._row_buffers[row - num_matrix_rows]
+
+    def _get_sequence(self, row):
+        return self._get_row_bytes(row).decode("ascii")
+
+    def _row_buffers_for_append(self):
+        """Move the alignment into one growable buffer per row."""
+        if self._seqs.shape[0] != 0:
+            self._row_buffers = [bytearray(row.tobytes()) for row in self._sequences()]
+            self._seqs = np.empty((0, 0), dtype=np.uint8)
+            self._gap_counts = None
+        else:
+            self._row_buffers = [
+                row if isinstance(row, bytearray) else bytearray(row)
+                for row in self._row_buffers
+            ]
+        return self._row_buffers
+
+    def _line(self, row):
+        """Get row as list of maf fields."""
+        return [
+            "s",
+            self.names[row],
+            str(self.starts[row]),
+            str(self.sizes[row]),
+            chr(self.strands[row]),
+            str(self.src_sizes[row]),
+            self._get_sequence(row),
+        ]
+
+    def _keep_rows(self, keep):
+        """Keep only the rows for which keep is true."""
+        keep = list(keep)
+        self._gap_counts = None
+        if self._seqs.shape[0] == 0:
+            self._row_buffers = [row for row, k in zip(self._row_buffers, keep) if k]
+        else:
+            self._set_sequences(self._sequences()[np.array(keep, dtype=bool)])
+        self.names = [name for name, k in zip(self.names, keep) if k]
+        self._build_index()
+        self.starts = array("q", (v for v, k in zip(self.starts, keep) if k))
+        self.sizes = array("q", (v for v, k in zip(self.sizes, keep) if k))
+        self.strands = bytearray(v for v, k in zip(self.strands, keep) if k)
+        self.src_sizes = array("q", (v for v, k in zip(self.src_sizes, keep) if k))
+
+    def _reorder_rows(self, order):
+        """Reorder rows by a list of row indices."""
+        self._gap_counts = None
+        if self._seqs.shape[0] == 0:
+            self._row_buffers = [self._row_buffers[i] for i in order]
+        else:
+            self._set_sequences(self._sequences()[order])
+        self.names = [self.names[i] for i in order]
+        self._build_index()
+        self.starts = array("q", (self.starts[i] for i in order))
+        self.sizes = array("q", (self.sizes[i] for i in order))
+        self.strands = bytearray(self.strands[i] for i in order)
+        self.src_sizes = array("q", (self.src_sizes[i] for i in order))
 
     def __str__(self):
         """Show the maf-block formatted like a maf-file."""
         if self.is_empty():
             return "Empty maf\n\n"
-        return "\n".join([" ".join(entry) for entry in self.block]) + "\n\n"
+        lines = [] if self.header is None else [self.header]
+        lines += [" ".join(self._line(row)) for row in range(len(self.names))]
+        return "\n".join(lines) + "\n\n"
 
     def add_index(self, index_object):
         """Add index to block index list."""
@@ -74,77 +369,92 @@ class MafBlock:
             raise ValueError("add_index() needs list or int.")
 
     def sort(self):
-        """Sort maf block based on species name."""
-        self.block[:1] = sorted(self.block[:1], key=lambda x: x[1])
+        """Sort maf block based on species name, the target stays first."""
+        if len(self.names) < 3:
+            return
+        order = [0] + sorted(range(1, len(self.names)), key=lambda i: self.names[i])
+        self._reorder_rows(order)
 
     def is_empty(self):
         """Test if object is empty."""
-        return self.block == []
+        return self.header is None and not self.names
 
     def size(self):
         """Get the number of aligned sequences."""
-        if self.is_empty():
-            return 0
-        return len(self.block) - 1
+        return len(self.names)
 
     def __len__(self):
         """Get the length of target sequence with gaps."""
-        if self.is_empty():
+        if not self.names:
             return 0
-        else:
-            return len(self.block[1][-1])
+        return len(self._get_row_bytes(0))
 
     def len_no_gaps(self):
         """Get the length of target sequence without gaps."""
-        if self.is_empty():
+        if not self.names:
             return 0
-        else:
-            return len(self.block[1][-1].replace("-", ""))
+        if self._seqs.shape[0] != 0:
+            return int(np.count_nonzero(self._seqs[0] != GAP))
+        return len(self._row_buffers[0]) - self._row_buffers[0].count(b"-")
+
+    def nbytes(self):
+        """Estimate the memory used by the alignment and the coordinates."""
+        num_bytes = self._seqs.nbytes + sum(len(row) for row in self._row_buffers)
+        if self._gap_counts is not None:
+            num_bytes += self._gap_counts.nbytes
+        return num_bytes + len(self.names) * (3 * self.starts.itemsize + 1)
 
     def get_target(self):
         """Get name of target species."""
-        return self.block[1][1]
+        return self.names[0]
+
+    def set_target(self, name):
+        """Set name of target species."""
+        self.names[0] = sys.intern(name)
+        self._build_index()
 
     def coordinates(self):
         """Return start and end of maf-block."""
-        if self.is_empty():
+        if not self.names:
             return -1, -1
-        return int(self.block[1][2]), int(self.block[1][2]) + int(self.block[1][3])
+        return self.starts[0], self.starts[0] + self.sizes[0]
 
     def add_suffix(self, suffix, only_target=True):
         """Add suffix to names in maf block."""
-        if self.is_empty():
+        if not self.names:
             return
         if only_target:
-            self.block[1][1] = self.block[1][1] + suffix
+            self.set_target(self.names[0] + suffix)
         else:
-            for entry in self.block:
-                if entry[0] == "a":
-                    continue
-                entry[1][1] = entry[1][1] + suffix
+            self.names = [sys.intern(name + suffix) for name in self.names]
+            self._build_index()
+
+    def _row_of_species(self, species):
+        """Get row index of species."""
+        try:
+            return self._index[species]
+        except KeyError as exc:
+            raise IndexError(f"{species} not in maf block") from exc
 
     def get_line_of_species(self, species):
         """Get index of line which is identified by species."""
-        # return [i for i, line in enumerate(self.blocks) if line[1] == species][0]
-        return [line for line in self.block if line[1] == species][0]
+        return self._line(self._row_of_species(species))
 
     def delete_species(self, species):
         """Delte species from block."""
         if isinstance(species, list):
-            for species_name in species:
-                self.delete_species(species_name)
+            species = set(species)
         else:
-            self.block = [line for line in self.block if line[1] != species]
+            species = {species}
+        if species.isdisjoint(self._index):
+            return
+        self._keep_rows(name not in species for name in self.names)
 
     def get_all_species(self, no_target=False):
         """Get all species in maf."""
-        if self.is_empty():
-            return []
         if no_target:
-            start = 2
-        else:
-            start = 1
-        return [line[1] for line in self.block[start:]]
+            return self.names[1:]
+        return list(self.names)
 
     def _system_call(self, call_str, env=None, shell=False):
         """Perform system call based on input str.
@@ -163,48 +473,81 @@ class MafBlock:
             process.wait()
             return process.returncode, process.communicate()[0].decode("UTF-8")
 
+    def html_rows(self):
+        """Get label and sequence of every row, as in the fasta for mview.
+
+        The rows are in the order of sort(), the block is not changed.
+        """
+        order = [0] + sorted(range(1, len(self.names)), key=lambda i: self.names[i])
+        labels = [
+            f"{self.names[row]}_{self.starts[row]}:{self.starts[row] + self.sizes[row]}"
+            for row in order
+        ]
+        return labels, [self._get_sequence(row) for row in order]
+
+    def to_html(self, title=None):
+        """Render the alignment as HTML fragment, empty blocks as a note."""
+        if self.is_empty() or not self.names:
+            return "<p>Empty Maf Block</p><br>"
+        labels, sequences = self.html_rows()
+        return render_alignment(labels, sequences, title)
+
     def generate_html(
-        self, out_dir, name=None, url_base=None, tmp_fasta_path="./tmp.fasta"
+        self, out_dir, name=None, url_base=None, tmp_fasta_path=None, use_mview=False
     ):
         """Write out a nice alignment view of the maf block.
 
-        Based on mview. (https://sourceforge.net/projects/bio-mview/files/bio-mview/mview-1.67/mview-1.67.tar.gz)
+        The view is appended to '<out_dir>/<name>.html'. It is rendered in
+        process, with the colours of mview. With use_mview the view is made by
+        mview. (https://sourceforge.net/projects/bio-mview/files/bio-mview/mview-1.67/mview-1.67.tar.gz)
+
+        :param str tmp_fasta_path: Fasta for mview, a temporary file if None.
+        :raise: SystemError if mview is not available or fails.
         """
+        empty = self.is_empty() or not self.names
+        if not name and not empty:
+            name = self.get_target()
         html_file_path = f"{out_dir}/{name}.html"
-        if self.is_empty():
+        if not use_mview or empty:
             with open(html_file_path, "a", encoding="UTF-8") as f_handle:
-                f_handle.write("<p>Empty Maf Block</p><br>")
-            return
-        self.sort()
-        return_code, out = self._system_call("command -v mview")
-        if return_code != 0:
-            raise SystemError("mview is not available")
-
-        with open(tmp_fasta_path, "w", encoding="UTF-8") as f_handle:
-            for entry in self.block:
-                if entry[0] == "a":
-                    continue
-                f_handle.write(
-                    f">{entry[1]}_{entry[2]}:{int(entry[3])+int(entry[2])}\n{entry[-1]}\n"
-                )
-        if not name:
-            name = self.block[1][1] if self.block[0][0] == "a" else self.block[0][1]
-
-        call = f"./mview_wrapper.sh {tmp_fasta_path} {html_file_path}"
-        return_code, out = self._system_call(call)
-        if return_code != 0 or out != "":
-            print(out)
-            raise SystemError("mview exited with error")
+                f_handle.write(self.to_html())
+        else:
+            self._mview_html(html_file_path, tmp_fasta_path)
 
         if url_base:
             print(f"See alignment under:\n{url_base}/{name}.html")
 
+    def _mview_html(self, html_file_path, tmp_fasta_path=None):
+        """Append the view of mview to html_file_path."""
+        if not mview_available():
+            raise SystemError("mview is not available")
+        with (
+            open(tmp_fasta_path, "w", encoding="UTF-8")
+            if tmp_fasta_path
+            else tempfile.NamedTemporaryFile("w", suffix=".fasta", encoding="UTF-8")
+        ) as f_handle:
+            for label, sequence in zip(*self.html_rows()):
+                f_handle.write(f">{label}\n{sequence}\n")
+            f_handle.flush()
+            with open(html_file_path, "a", encoding="UTF-8") as html_handle:
+                process = subprocess.run(
+                    ["mview", "-in", "fasta", "-html", "data", "-bold", "-colormap", "CLUSTAL",
+                     "-coloring", "any", f_handle.name, "-conservation", "on"],
+                    stdout=html_handle,
+                    stderr=subprocess.PIPE,
+                    check=False,
+                )
+        if process.returncode != 0 or process.stderr:
+            print(process.stderr.decode("UTF-8"))
+            raise SystemError("mview exited with error")
+
     def split_maf_block(self, split_start, split_end, suffix=""):
         """Split maf-block based on start and stop.
 
-        The function will also change the genomic coordinates accordingly.
+        The function will also change the genomic coordinates accordingly. The
+        gaps are looked up in the gap index of the block and the alignment of
+        the new block is a view on the alignment of this block.
 
-        :param list maf_block: list of list represtation of maf block.
         :param int split_start: start of split.
         :param int split_end: end  of split.
         :param str suffix: opional suffix that will be appended to name.
@@ -212,66 +555,119 @@ class MafBlock:
             smaller or equal to split_start or if split_end is bigger than length
             of alignment.
         :return: smaller maf-block
-        :rtype: list
+        :rtype: MafBlock
         """
         if split_start < 0 or split_start > split_end:
             raise IndexError("Maf split start must be above 0.")
         new_maf = MafBlock()
-        for entry in self.block:
-            if entry[0] == "a":
-                new_maf.add(entry)
-                continue
-            maf_type = entry[0]
-            if suffix != "":
-                name = entry[1] + "-" + str(suffix)
-            else:
-                name = entry[1]
-            start = entry[2]
-            size = entry[3]
-            strand = entry[4]
-            scr_size = entry[5]
-            sequence = entry[6]
-            if split_end > len(sequence):
-                raise IndexError("Maf split end can not be bigger than sequence.")
-            num_gaps_before_start = sequence[0:split_start].count("-")
-            sequence = sequence[split_start:split_end]
-            num_gaps = sequence.count("-")
-            size = str(split_end - split_start - num_gaps)
-            if strand == "+":
-                start = str(int(start) + int(split_start) - num_gaps_before_start)
-            else:
-                start = str(int(start) + int(split_start) - num_gaps_before_start)
-            new_maf.add(
-                f"{maf_type} {name} {start} {size} {strand} {scr_size} {sequence}"
-            )
+        new_maf.header = self.header
+        if not self.names:
+            return new_maf
+        seqs = self._sequences()
+        if split_end > seqs.shape[1]:
+            raise IndexError("Maf split end can not be bigger than sequence.")
+        gap_counts = self._gap_index()
+        num_gaps_before_start = gap_counts[:, split_start]
+        num_gaps = gap_counts[:, split_end] - num_gaps_before_start
+        if suffix != "":
+            new_maf.names = [sys.intern(f"{name}-{suffix}") for name in self.names]
+        else:
+            new_maf.names = list(self.names)
+        new_maf._build_index()
+        new_maf.starts = int_array(
+            np.frombuffer(self.starts, dtype=np.int64)
+            + split_start
+            - num_gaps_before_start
+        )
+        new_maf.sizes = int_array(split_end - split_start - num_gaps)
+        new_maf.strands = bytearray(self.strands)
+        new_maf.src_sizes = array("q", self.src_sizes)
+        new_maf._set_sequences(seqs[:, split_start:split_end])
         return new_maf
 
-    def preprocess_block(self, max_len_no_split):
-        """Preprocess bock by splitting long blocks into list of smaller blocks."""
-        if len(self.block[1][-1]) < max_len_no_split:
-            return [self]
+    def split_windows(self, max_len_no_split):
+        """Split long block with a sliding window of half window size steps."""
+        if len(self) < max_len_no_split:
+            yield self
+            return
 
-        split_mafs = []
-        end_reached = False
-        for i, start in enumerate(
-            range(0, len(self.block[1][-1]), int(max_len_no_split / 2))
-        ):
+        for i, start in enumerate(range(0, len(self), int(max_len_no_split / 2))):
             end = start + max_len_no_split
-            if end >= len(self.block[1][-1]):
-                end = len(self.block[1][-1])
-                end_reached = True
-            split_mafs += [self.split_maf_block(start, end, suffix=f"split-{i}")]
-            if end_reached:
+            if end >= len(self):
+                yield self.split_maf_block(start, len(self), suffix=f"split-{i}")
                 break
-        return split_mafs
+            yield self.split_maf_block(start, end, suffix=f"split-{i}")
+
+    def preprocess_block(self, max_len_no_split):
+        """Preprocess bock by splitting long blocks into list of smaller blocks."""
+        return list(self.split_windows(max_len_no_split))
 
     def add_symbols(self, symbol, positions):
-        """Add symbol to every position in alignment."""
-        for entry in self.block:
-            if entry[0] == "a":
-                continue
-            for position in positions:
-                entry[-1] = entry[-1][:position] + symbol + entry[-1][position:]
+        """Add symbol to every position in alignment.
+
+        The positions are applied one after the other, each one in the
+        alignment with the symbols of the positions before. A position out of
+        range is clamped like a slice, after the end appends the symbol. Sorted
+        positions are inserted in one pass, see insert_symbols().
+        """
+        if not self.names:
+            return
+        positions = list(positions)
+        # Positions in the alignment before any insertion, possible as long
+        # as no position is before or inside a symbol inserted before.
+        original_positions = []
+        # End of the symbols inserted so far
+        end = 0
+        for i, position in enumerate(positions):
+            if i > 0 and position == positions[i - 1]:
+                original_positions.append(original_positions[-1])
+                end += len(symbol)
+            elif position >= end:
+                original_positions.append(position - i * len(symbol))
+                end = position + len(symbol)
+            else:
+                break
+        if len(original_positions) == len(positions) and (
+            not positions or original_positions[-1] <= len(self)
+        ):
+            self.insert_symbols(symbol, original_positions)
+            return
+        symbol = list(symbol.encode("ascii"))
+        seqs = self._sequences()
+        for position in positions:
+            # Like slicing the sequence at position, out of range is clamped
+            length = seqs.shape[1]
+            position = min(position, length) if position >= 0 else max(position + length, 0)
+            seqs = np.insert(seqs, [position] * len(symbol), symbol, axis=1)
+        self._set_sequences(seqs)
+
+    def insert_symbols(self, symbol, positions):
+        """Insert symbol before each of the sorted positions in one pass.
+
+        The positions are columns of the alignment before any insertion, the
+        length of the alignment appends the symbol. All rows get the symbol,
+        the coordinates do not change.
+
+        :param str symbol: Symbol to insert, can be more than one character.
+        :param list positions: Sorted positions, a position can repeat.
+        :raise: ValueError if the positions are not sorted or out of range.
+        """
+        if not self.names or not positions:
+            return
+        positions = np.asarray(positions, dtype=np.int64)
+        if np.any(positions[1:] < positions[:-1]):
+            raise ValueError("Positions must be sorted.")
+        if positions[0] < 0 or positions[-1] > len(self):
+            raise ValueError("Position out of range.")
+        symbol = np.frombuffer(symbol.encode("ascii"), dtype=np.uint8)
+        self._set_sequences(
+            np.insert(
+                self._sequences(),
+                np.repeat(positions, len(symbol)),
+                np.tile(symbol, len(positions)),
+                axis=1,
+            )
+        )
 
     def is_continuous_with(self, other):
         """Test if two maf blocks are continuous.
@@ -283,38 +679,34 @@ class MafBlock:
         before the current block the two blocks are also discontinous. Ignored
         are species that only exist in one block but not the other, because
         these species can be easily replaced with only gaps in the next block.
+        The target, the first row, is compared even though its name has the
+        block index as suffix.
 
         :param MafBlock arg1: Another MafBlock.
         :return: bigest distance of two sequences between any species which are
             continous. And a list of species which are discontinous.
         :rtype: (int, list)
         """
-        if int(self.block[1][2]) > int(other.block[1][2]):
+        if self.starts[0] > other.starts[0]:
             raise ValueError("Maf block self is after maf block other")
 
-        other_species = set(other.get_all_species())
-        self_species = set(self.get_all_species())
-
         max_dist = 0
         discontious_species = []
-        for species in other_species.intersection(self_species):
-            species_line_self = self.get_line_of_species(species)
-            end_self = int(species_line_self[2]) + int(species_line_self[3])
-            strand_self = species_line_self[4]
-
-            species_line_other = other.get_line_of_species(species)
-            start_other = int(species_line_other[2])
-            strand_other = species_line_other[4]
-            # print(species)
-            # print(start_other - end_self)
+        for row_self, species in enumerate(self.names):
+            # The target is always the first row, its name has the block index
+            if row_self == 0:
+                row_other = 0
+            else:
+                row_other = other._index.get(species)
+                if row_other in (None, 0) or self._index[species] != row_self:
+                    continue
+            end_self = self.starts[row_self] + self.sizes[row_self]
+            start_other = other.starts[row_other]
             if (
-                strand_self != strand_other
+                self.strands[row_self] != other.strands[row_other]
                 or end_self + self.allowed_dist < start_other
                 or end_self > start_other
             ):
-                # print(
-                #     f"Discontious because of {species}-> strand:{strand_self != strand_other}, distance:{start_other - end_self}, reverse:{end_self > start_other}"
-                # )
                 discontious_species.append(species)
             else:
                 max_dist = max(start_other - end_self, max_dist)
@@ -324,6 +716,8 @@ class MafBlock:
     def concat(self, other, max_del=0):
         """Concat to maf blocks.
 
+        The block other is not changed.
+
         :param MafBlock arg1: Another MafBlock.
         :param int arg1: The number of species that are allowed to be deleted.
         :return: 0 if concatination was sucessfull, negativ int if x species
@@ -331,77 +725,49 @@ class MafBlock:
         :rtype: int
         """
         max_dist, discontious_species = self.is_continuous_with(other)
-        # VERBOSE
-        # print(f"The two blocks have a maximal distance {max_dist} and {discontious_species} discontious species.")
 
         if self.get_target() in discontious_species:
             return -float("inf")
 
         if len(discontious_species) > max_del:
-            # VERBOSE
-            # print(discontious_species)
             return -len(discontious_species)
 
-        new_other = deepcopy(other)
-
-        self.add_index(new_other.block_index_list)
+        self.add_index(other.block_index_list)
 
         # This deletes species if no species imped, list should be empty.
         self.delete_species(discontious_species)
-        new_other.delete_species(discontious_species)
+        discontious_species = set(discontious_species)
 
-        # Below could be a private method
         length_other = len(other)
         length_self = len(self)
-        other_species = set(new_other.get_all_species(no_target=True))
-        self_species = set(self.get_all_species(no_target=True))
-
-        # VERBOSE
-        # if other_species != self_species:
-        #     print(f"Add species to other: {self_species - other_species}")
-        #     print(f"Add species to self: {other_species - self_species}")
-        #     # print(other_species)
-        #     # print(self_species)
-        # if max_dist != 0:
-        #     print(f"Add bridge length {max_dist}")
-
-        # Add new species to other
-        for species in self_species - other_species:
-            species_line_self = self.get_line_of_species(species)
-            start = str(int(species_line_self[2]) + int(species_line_self[3]))
-            strand = species_line_self[4]
-            genome_length = species_line_self[5]
-            new_other.add(
-                ["s", species, start, "0", strand, genome_length, "-" * length_other]
-            )
+        row_buffers = self._row_buffers_for_append()
 
-        # Add new species to self
-        for species in other_species - self_species:
-            species_line_other = other.get_line_of_species(species)
-            genome_length = species_line_other[5]
-            strand = species_line_other[4]
-            start = species_line_other[2]
-            self.add(
-                ["s", species, start, "0", strand, genome_length, "-" * length_self]
+        # Add species of other that are missing in self as gap rows
+        for row_other in range(1, len(other.names)):
+            species = other.names[row_other]
+            if species in self._index or species in discontious_species:
+                continue
+            self._add_row(
+                species,
+                other.starts[row_other],
+                0,
+                chr(other.strands[row_other]),
+                other.src_sizes[row_other],
+                bytearray(b"-" * length_self),
             )
 
-        # Concat
-        for i, self_line in enumerate(self.block[1:]):
-            # First line is target
-            if i == 0:
-                other_line = new_other.block[1]
-            # Get the other line
-            else:
-                species = self_line[1]
-                other_line = new_other.get_line_of_species(species)
-            end_self = int(self_line[2]) + int(self_line[3])
-            start_other = int(other_line[2])
-            dist = start_other - end_self
-            gap_seq = dist * "N" + (max_dist - dist) * "-"
-            # new length
-            self_line[3] = str(int(self_line[3]) + int(other_line[3]) + dist)
-            # new seq
-            self_line[6] = self_line[6] + gap_seq + other_line[6]
+        # Concat, the target is always the first row.
+        for row_self, species in enumerate(self.names):
+            row_other = 0 if row_self == 0 else other._index.get(species)
+            # Missing in other, continues directly after self.
+            if row_other is None:
+                row_buffers[row_self] += b"-" * (max_dist + length_other)
+                continue
+            end_self = self.starts[row_self] + self.sizes[row_self]
+            dist = other.starts[row_other] - end_self
+            self.sizes[row_self] += other.sizes[row_other] + dist
+            row_buffers[row_self] += b"N" * dist + b"-" * (max_dist - dist)
+            row_buffers[row_self] += other._get_row_bytes(row_other)
 
         return 0
 
@@ -410,26 +776,374 @@ class MafBlock:
 
         Cut rows with only gaps in target at beginning and end.
         Remove rows which only consists of rows.
+
+        All rows are checked at once on the alignment matrix, a row is
+        removed if at least MAX_UNDEFINED percent are gaps or N. A block
+        without target sequence keeps only the target.
         """
-        try:
-            start_row = [
-                m.start() + len(m.group()) for m in re.finditer("^-+", self.block[1][-1])
-            ][0]
-        except IndexError:
-            start_row = 0
+        if not self.names:
+            return
+        seqs = self._sequences()
+        not_gap = np.flatnonzero(seqs[0] != GAP)
+        if len(not_gap) == 0:
+            seqs = seqs[:, :0]
+            keep = np.zeros(seqs.shape[0], dtype=bool)
+        else:
+            seqs = seqs[:, not_gap[0]:not_gap[-1] + 1]
+            keep = percent_undefined_rows(seqs) < MAX_UNDEFINED
+        keep[0] = True
+        self._set_sequences(seqs)
+        if not keep.all():
+            self._keep_rows(keep.tolist())
+
+
+class MafIndex:
+    """A persistent index of checkpoints into a maf file.
+
+    A checkpoint is a block start from where the file can be read without
+    decompressing anything before it. It knows the block index, the target
+    start, the offset in the uncompressed maf text and the offset in the data
+    file. Checkpoints are roughly CHECKPOINT_SIZE uncompressed bytes apart.
+
+    A gzip stream can not be entered in the middle, hence a gzipped maf file
+    is recompressed once into a copy next to it (chr1.maf.gz -> chr1.maf.bgz)
+    made of independent gzip members that each start at a checkpoint, like
+    BGZF. Uncompressed maf files are indexed in place. The index is saved as
+    numpy archive next to the maf file (chr1.maf.gz.idx.npz) and is stale
+    when size or modification time of the maf file changed.
+    """
+
+    def __init__(self, maf_path, checkpoints, num_blocks):
+        """Init index from the checkpoint arrays, see build() and load()."""
+        self.maf_path = maf_path
+        self.data_path = self.get_data_path(maf_path)
+        self.block_indices = checkpoints["block_indices"]
+        self.target_starts = checkpoints["target_starts"]
+        self.off_sets = checkpoints["off_sets"]
+        self.data_offsets = checkpoints["data_offsets"]
+        self.num_blocks = num_blocks
+
+    @staticmethod
+    def get_index_path(maf_path):
+        """Get path of the index file of a maf file."""
+        return f"{maf_path}.idx.npz"
+
+    @staticmethod
+    def get_data_path(maf_path):
+        """Get path of the file the index points into."""
+        if maf_path.endswith(".gz"):
+            return maf_path[: -len(".gz")] + ".bgz"
+        return maf_path
+
+    @classmethod
+    def build(cls, maf_path):
+        """Build and save the index of a maf file.
+
+        :param str maf_path: Path to a maf file, gzipped or not.
+        :return: The index.
+        :rtype: MafIndex
+        """
+        compress = maf_path.endswith(".gz")
+        data_path = cls.get_data_path(maf_path)
+        source_stat = os.stat(maf_path)
+        checkpoints = {
+            "block_indices": [],
+            "target_starts": [],
+            "off_sets": [],
+            "data_offsets": [],
+        }
+        # Blocks are collected until the next checkpoint is reached
+        member = []
+        member_size = 0
+        data_offset = 0
+        target_start = 0
+        num_blocks = 0
+
+        open_fn = gzip.open if compress else open
+        with open_fn(maf_path, "rb") as maf_handle, open(
+            f"{data_path}.tmp" if compress else os.devnull, "wb"
+        ) as data_handle:
+            for block_index, off_set, raw_block in split_raw_blocks(maf_handle):
+                num_blocks = block_index + 1
+                if member_size >= CHECKPOINT_SIZE:
+                    if compress:
+                        data_offset += data_handle.write(
+                            gzip.compress(b"".join(member), mtime=0)
+                        )
+                    member = []
+                    member_size = 0
+                if member_size == 0:
+                    # Empty blocks keep the start of the checkpoint before
+                    target_start = max(raw_block_coordinates(raw_block)[0], target_start)
+                    checkpoints["block_indices"].append(block_index)
+                    checkpoints["target_starts"].append(target_start)
+                    checkpoints["off_sets"].append(off_set)
+                    checkpoints["data_offsets"].append(data_offset if compress else off_set)
+                if compress:
+                    member.append(raw_block + b"\n")
+                member_size += len(raw_block) + 1
+            if member:
+                data_handle.write(gzip.compress(b"".join(member), mtime=0))
+        if compress:
+            os.replace(f"{data_path}.tmp", data_path)
+
+        checkpoints = {
+            key: np.array(values, dtype=np.int64) for key, values in checkpoints.items()
+        }
+        index_path = cls.get_index_path(maf_path)
+        with open(f"{index_path}.tmp", "wb") as f_handle:
+            np.savez(
+                f_handle,
+                num_blocks=np.int64(num_blocks),
+                source_size=np.int64(source_stat.st_size),
+                source_mtime=np.int64(source_stat.st_mtime_ns),
+                **checkpoints,
+            )
+        os.replace(f"{index_path}.tmp", index_path)
+        return cls(maf_path, checkpoints, num_blocks)
 
-        try:
-            end_row = [m.start() for m in re.finditer("-+$", self.block[1][-1])][0]
-        except IndexError:
-            end_row = len(self.block[1][-1])
+    @classmethod
+    def load(cls, maf_path):
+        """Load the index of a maf file.
 
-        self.block[1:] = [
-            line[:-1] + [line[-1][start_row:end_row]] for line in self.block[1:]
-        ]
+        :return: The index or None if there is no index or it is stale.
+        :rtype: MafIndex
+        """
+        index_path = cls.get_index_path(maf_path)
+        if not os.path.isfile(index_path) or not os.path.isfile(
+            cls.get_data_path(maf_path)
+        ):
+            return None
+        source_stat = os.stat(maf_path)
+        with np.load(index_path) as index_file:
+            if (
+                int(index_file["source_size"]) != source_stat.st_size
+                or int(index_file["source_mtime"]) != source_stat.st_mtime_ns
+            ):
+                return None
+            checkpoints = {
+                key: index_file[key]
+                for key in ("block_indices", "target_starts", "off_sets", "data_offsets")
+            }
+            num_blocks = int(index_file["num_blocks"])
+        return cls(maf_path, checkpoints, num_blocks)
+
+    def checkpoint_at_block(self, block_index):
+        """Get the last checkpoint at or before a block index."""
+        return max(
+            int(np.searchsorted(self.block_indices, block_index, side="right")) - 1, 0
+        )
+
+    def checkpoint_at_offset(self, off_set):
+        """Get the last checkpoint at or before an uncompressed offset."""
+        return max(int(np.searchsorted(self.off_sets, off_set, side="right")) - 1, 0)
+
+    def checkpoint_at_position(self, position):
+        """Get the last checkpoint starting at or before a target position.
+
+        Blocks on the target are sorted and do not overlap, hence no block
+        before this checkpoint can reach the position.
+        """
+        return max(
+            int(np.searchsorted(self.target_starts, position, side="right")) - 1, 0
+        )
+
+    def get_checkpoint(self, checkpoint):
+        """Get block index and uncompressed offset of a checkpoint."""
+        return int(self.block_indices[checkpoint]), int(self.off_sets[checkpoint])
+
+    @contextmanager
+    def open_at(self, checkpoint):
+        """Open the maf text at a checkpoint as binary handle."""
+        with open(self.data_path, "rb") as data_handle:
+            data_handle.seek(int(self.data_offsets[checkpoint]))
+            if self.data_path == self.maf_path:
+                yield data_handle
+            else:
+                with gzip.GzipFile(fileobj=data_handle, mode="rb") as maf_handle:
+                    yield maf_handle
 
-        self.block[2:] = [
-            line for line in self.block[2:] if percent_undefined(line[-1]) < 95
-        ]
+
+class LruCache(OrderedDict):
+    """Dictionary that keeps only the most recently used items.
+
+    The least recently used items are dropped while there are more than
+    max_size items or their estimated size is more than max_bytes. Lookups
+    with get() are counted as hits or misses.
+    """
+
+    def __init__(self, max_size, max_bytes=None, sizeof=sys.getsizeof):
+        """Init empty cache.
+
+        :param int max_bytes: Maximal estimated size, None for no limit.
+        :param sizeof: Function that estimates the size of a value.
+        """
+        super().__init__()
+        self.max_size = max_size
+        self.max_bytes = max_bytes
+        self.sizeof = sizeof
+        self.num_bytes = 0
+        self.hits = 0
+        self.misses = 0
+
+    def __getitem__(self, key):
+        """Get item and mark it as used."""
+        value = super().__getitem__(key)
+        self.move_to_end(key)
+        return value
+
+    def get(self, key, default=None):
+        """Get item and mark it as used, default if it is not cached."""
+        if key in self:
+            self.hits += 1
+            return self[key]
+        self.misses += 1
+        return default
+
+    def __setitem__(self, key, value):
+        """Set item, least recently used items are dropped if the cache is full."""
+        if key in self:
+            self.num_bytes -= self.sizeof(super().__getitem__(key))
+        super().__setitem__(key, value)
+        self.move_to_end(key)
+        self.num_bytes += self.sizeof(value)
+        while len(self) > self.max_size or (
+            self.max_bytes is not None and self.num_bytes > self.max_bytes and len(self) > 1
+        ):
+            self.popitem(last=False)
+
+    def __delitem__(self, key):
+        """Delete item."""
+        self.num_bytes -= self.sizeof(super().__getitem__(key))
+        super().__delitem__(key)
+
+    def pop(self, key, *default):
+        """Remove item and get it, default if it is not cached."""
+        if key not in self:
+            return super().pop(key, *default)
+        value = super().pop(key)
+        self.num_bytes -= self.sizeof(value)
+        return value
+
+    def popitem(self, last=True):
+        """Remove the last, or first, item and get it."""
+        key, value = super().popitem(last)
+        self.num_bytes -= self.sizeof(value)
+        return key, value
+
+    def stats(self):
+        """Get number of items, estimated size, hits, misses and hit rate."""
+        return cache_stats(len(self), self.num_bytes, self.hits, self.misses)
+
+
+def cache_stats(entries, num_bytes, hits, misses):
+    """Get statistics of a cache as dictionary."""
+    return {
+        "entries": entries,
+        "bytes": num_bytes,
+        "hits": hits,
+        "misses": misses,
+        "hit_rate": hits / (hits + misses) if hits + misses else 0.0,
+    }
+
+
+class OffsetCheckpoints:
+    """Offsets of some blocks seen while reading a maf file.
+
+    The offset of a block is only kept if it is at least spacing bytes after
+    the last one, so memory grows with the file size divided by spacing. The
+    block indices and offsets are sorted integer arrays, the closest
+    checkpoint before a block is found by bisection. Lookups are counted as
+    hits if a checkpoint is found, else reading starts at the file start.
+    """
+
+    def __init__(self, spacing=CHECKPOINT_SIZE):
+        """Init without checkpoints."""
+        self.spacing = spacing
+        self.block_indices = array("q")
+        self.off_sets = array("q")
+        self.hits = 0
+        self.misses = 0
+
+    def __len__(self):
+        """Get number of checkpoints."""
+        return len(self.block_indices)
+
+    def add(self, block_index, off_set):
+        """Add offset of a block, if it is far enough after the last checkpoint."""
+        if self.block_indices and (
+            block_index <= self.block_indices[-1] or off_set - self.off_sets[-1] < self.spacing
+        ):
+            return
+        self.block_indices.append(block_index)
+        self.off_sets.append(off_set)
+
+    def get(self, block_index):
+        """Get the closest checkpoint at or before block_index.
+
+        :return: Block index and offset, (0, 0) if there is none.
+        :rtype: tuple
+        """
+        i = bisect_right(self.block_indices, block_index) - 1
+        if i < 0:
+            self.misses += 1
+            return 0, 0
+        self.hits += 1
+        return self.block_indices[i], self.off_sets[i]
+
+    def nbytes(self):
+        """Get memory used by the checkpoints."""
+        return len(self.block_indices) * (self.block_indices.itemsize + self.off_sets.itemsize)
+
+    def stats(self):
+        """Get number of checkpoints, memory, hits, misses and hit rate."""
+        return cache_stats(len(self), self.nbytes(), self.hits, self.misses)
+
+
+class RawBlockWindow:
+    """Bounded window over the raw blocks of a maf stream, for looking ahead.
+
+    Blocks are read once and kept raw for the last max_size block indices.
+    A block is parsed on every get(), so the caller may change it. A block
+    that already left the window is read again from the file.
+    """
+
+    def __init__(self, maf_stream, block_index=0, max_size=LOOKAHEAD_SIZE):
+        """Init window starting at block_index."""
+        self.maf_stream = maf_stream
+        self.max_size = max_size
+        self._start(block_index)
+
+    def _start(self, block_index):
+        self.raw_blocks = self.maf_stream.raw_blocks_from(block_index)
+        self.window = deque()
+        # Block index of window[0]
+        self.first_index = block_index
+        self.at_end = False
+
+    def get(self, block_index):
+        """Get block with index and suffix like in MafStream.concat_blocks().
+
+        :return: The block, None if block_index is after the last block.
+        :rtype: MafBlock
+        """
+        if block_index < self.first_index:
+            self._start(block_index)
+        while self.first_index + len(self.window) <= block_index:
+            if self.at_end:
+                return None
+            raw_block_entry = next(self.raw_blocks, None)
+            if raw_block_entry is None:
+                self.at_end = True
+                return None
+            self.window.append(raw_block_entry[2])
+            if len(self.window) > self.max_size:
+                self.window.popleft()
+                self.first_index += 1
+        maf = MafBlock(self.window[block_index - self.first_index])
+        maf.add_index(block_index)
+        maf.add_suffix(f"_block-index_{block_index}")
+        return maf
 
 
 class MafStream:
@@ -452,135 +1166,138 @@ class MafStream:
                 raise ValueError("all arguments must be set")
 
             setattr(self, arg, value)
-        # Saves off set for each block to make iteration faster.
-        # key: block_index val: off_set
-        self.off_set_dic = {}
-        # Previous calculated blocks
-        # key: block_index val: MafBlock()
-        self.block_dic = {}
+        # Saves off set of some blocks to make iteration faster.
+        self.off_set_dic = OffsetCheckpoints()
+        # Previous calculated blocks of the look ahead
+        # key: block_index val: (end block index, MafBlock())
+        self.block_dic = LruCache(MEMO_SIZE, MEMO_BYTES, lambda future: future[1].nbytes())
+        # Checkpoints for random access, None if the file is not indexed.
+        self.index = MafIndex.load(self.path)
+
+    def build_index(self):
+        """Build the persistent index of the maf file, see MafIndex."""
+        self.index = MafIndex.build(self.path)
+
+    def _open(self):
+        if self.path.endswith("gz"):
+            return gzip.open(self.path, "rb")
+        return open(self.path, "rb")
+
+    def raw_blocks(self, block_index=0, off_set=0):
+        """Iterate over the raw maf blocks in file.
+
+        Yields the block index, the offset of the block in the (uncompressed)
+        file and the bytes of the block without the empty line, see
+        split_raw_blocks(). Enough for consumers that only need coordinates,
+        see raw_block_coordinates(). With an index reading starts at the
+        closest checkpoint instead of the start of the file.
+
+        :param int block_index: Index of the block at off_set.
+        :param int off_set: Offset of a block start to begin reading at.
+        """
+        if self.index is None:
+            with self._open() as maf_handle:
+                if off_set != 0:
+                    maf_handle.seek(off_set)
+                yield from split_raw_blocks(maf_handle, block_index, off_set)
+            return
+
+        checkpoint = self.index.checkpoint_at_offset(off_set)
+        with self.index.open_at(checkpoint) as maf_handle:
+            for raw_block_entry in split_raw_blocks(
+                maf_handle, *self.index.get_checkpoint(checkpoint)
+            ):
+                if raw_block_entry[1] >= off_set:
+                    yield raw_block_entry
 
     def __iter__(self):
         """Iterat over maf blocks in file."""
-        if self.path.endswith("gz"):
-            open_fn = gzip.open
-            read_arg = "rb"
-        else:
-            open_fn = open
-            read_arg = "r"
-        block_index = 0
-        maf = MafBlock()
-        with open_fn(self.path, read_arg) as maf_handle:
-            while True:
-                line = maf_handle.readline()
-                try:
-                    line = line.decode("UTF8")
-                except AttributeError:
-                    pass
-                # EOF
-                if line == "":
-                    break
-
-                if line != "\n":
-                    maf.add(line)
-                else:
-                    maf.add_index(block_index)
-                    yield maf
-                    maf = MafBlock()
-                    block_index += 1
+        for block_index, _off_set, raw_block in self.raw_blocks():
+            maf = MafBlock(raw_block)
+            maf.add_index(block_index)
+            yield maf
 
     def iterate_from_use_offset(self, block_index):
         """Iterate over maf blocks starting with specific block index.
 
-        The attribute off_set_dic is used to make jumps.
+        The attribute off_set_dic is used to make jumps, reading starts at the
+        closest checkpoint before block_index.
         """
-        if self.path.endswith("gz"):
-            open_fn = gzip.open
-            read_arg = "rb"
-        else:
-            open_fn = open
-            read_arg = "r"
-
-        if block_index in self.off_set_dic:
-            current_block_index = block_index
-            off_set = self.off_set_dic[current_block_index]
-        # If block index is not in dic get highest block index
-        # This should be used most of the time. Maybe a list would be quicker
-        # compared to dic?
-        elif len(self.off_set_dic) == 0:
-            current_block_index = 0
-            off_set = 0
-        else:
-            current_block_index = sorted(list(self.off_set_dic.keys()))[-1]
-            off_set = self.off_set_dic[current_block_index]
-
-        maf = MafBlock()
-        with open_fn(self.path, read_arg) as maf_handle:
-            maf_handle.seek(off_set)
-            while True:
-                line = maf_handle.readline()
-                try:
-                    line = line.decode("UTF8")
-                except AttributeError:
-                    pass
-                # EOF
-                if line == "":
-                    if current_block_index < block_index:
-                        raise IndexError("block index out of range")
-                    break
+        current_block_index, off_set = self.off_set_dic.get(block_index)
+        next_block_index = current_block_index
+        for current_block_index, off_set, raw_block in self.raw_blocks(
+            current_block_index, off_set
+        ):
+            self.off_set_dic.add(current_block_index, off_set)
+            next_block_index = current_block_index + 1
+            if current_block_index >= block_index:
+                maf = MafBlock(raw_block)
+                maf.add_index(current_block_index)
+                yield maf
+        if next_block_index < block_index:
+            raise IndexError("block index out of range")
 
-                if line[0] == "a":
-                    self.off_set_dic[current_block_index] = off_set
+    def raw_blocks_from(self, block_index):
+        """Iterate over the raw maf blocks starting with specific block index.
 
-                off_set += len(line)
+        With an index decoding starts at the closest checkpoint.
 
-                if line != "\n":
-                    maf.add(line)
-                else:
-                    maf.add_index(current_block_index)
-                    if current_block_index >= block_index:
-                        yield maf
-                    maf = MafBlock()
-                    current_block_index += 1
+        :raise: IndexError if the file has no block with block_index.
+        """
+        start = (0, 0)
+        if self.index is not None:
+            start = self.index.get_checkpoint(self.index.checkpoint_at_block(block_index))
+        next_block_index = start[0]
+        for raw_block_entry in self.raw_blocks(*start):
+            next_block_index = raw_block_entry[0] + 1
+            if raw_block_entry[0] >= block_index:
+                yield raw_block_entry
+
+        if next_block_index < block_index:
+            raise IndexError("block index out of range")
 
     def iterate_from(self, block_index):
-        """Iterate over maf blocks starting with specific block index."""
-        if self.path.endswith("gz"):
-            open_fn = gzip.open
-            read_arg = "rb"
-        else:
-            open_fn = open
-            read_arg = "r"
+        """Iterate over maf blocks starting with specific block index.
 
-        current_block_index = 0
-        maf = MafBlock()
-        with open_fn(self.path, read_arg) as maf_handle:
-            while True:
-                line = maf_handle.readline()
-                try:
-                    line = line.decode("UTF8")
-                except AttributeError:
-                    pass
-                # EOF
-                if line == "":
-                    break
+        Blocks before block_index are skipped without parsing them. With an
+        index decoding starts at the closest checkpoint.
+        """
+        for current_block_index, _off_set, raw_block in self.raw_blocks_from(block_index):
+            maf = MafBlock(raw_block)
+            maf.add_index(current_block_index)
+            yield maf
 
-                if line != "\n":
-                    maf.add(line)
-                else:
-                    maf.add_index(current_block_index)
-                    if current_block_index >= block_index:
-                        yield maf
-                    maf = MafBlock()
-                    current_block_index += 1
+    def iterate_from_position(self, position):
+        """Iterate over maf blocks starting with the first block ending at or after position.
 
-        if current_block_index < block_index:
-            raise IndexError("block index out of range")
+        All blocks after that one are yielded, whatever their coordinates.
+        With an index decoding starts at the closest checkpoint.
+        """
+        start = (0, 0)
+        if self.index is not None:
+            start = self.index.get_checkpoint(self.index.checkpoint_at_position(position))
+        reached = False
+        for block_index, _off_set, raw_block in self.raw_blocks(*start):
+            if not reached:
+                if raw_block_coordinates(raw_block)[1] < position:
+                    continue
+                reached = True
+            maf = MafBlock(raw_block)
+            maf.add_index(block_index)
+            yield maf
+
+    def concat_blocks_trivial(
+        self, position=(), index_range=(0, float("inf")), blocks=None
+    ):
+        """Concatinate blocks without any deletion.
 
-    def concat_blocks_trivial(self, position=(), index_range=(0, float("inf"))):
-        """Concatinate blocks without any deletion."""
+        The blocks are read from the file, or taken from blocks if given.
+        """
         maf = MafBlock()
+        if blocks is None:
+            blocks = self.iterate_from(index_range[0])
 
-        for next_maf in self.iterate_from(index_range[0]):
+        for next_maf in blocks:
             # Only first iteration
             if maf.is_empty():
                 maf = next_maf
@@ -601,11 +1318,15 @@ class MafStream:
         if max(maf.block_index_list) < index_range[1]:
             yield maf
 
-    def concat_blocks_with_deletion(self, position=(), index_range=(0, float("inf"))):
+    def concat_blocks_with_deletion(
+        self, position=(), index_range=(0, float("inf")), blocks=None
+    ):
         """Concatinate blocks with deletion."""
         maf = MafBlock()
 
-        for next_maf in self.concat_blocks_trivial(position=position, index_range=index_range):
+        for next_maf in self.concat_blocks_trivial(
+            position=position, index_range=index_range, blocks=blocks
+        ):
             # Only first iteration
             if maf.is_empty():
                 maf = next_maf
@@ -626,27 +1347,18 @@ class MafStream:
         if maf != next_maf:
             yield maf
 
-    def split_stream(self, position=(), index_range=(0, float("inf"))):
+    def split_stream(self, position=(), index_range=(0, float("inf")), blocks=None):
         """Split blocks with sliding window."""
-        for maf in self.concat_blocks_with_deletion(position=position, index_range=index_range):
-            if len(maf) < self.max_len_no_split:
-                yield maf
-                continue
-            end_reached = False
-            for i, start in enumerate(
-                range(0, len(maf), int(self.max_len_no_split / 2))
-            ):
-                end = start + self.max_len_no_split
-                if end >= len(maf):
-                    end = len(maf)
-                    end_reached = True
-                yield maf.split_maf_block(start, end, suffix=f"split-{i}")
-                if end_reached:
-                    break
+        for maf in self.concat_blocks_with_deletion(
+            position=position, index_range=index_range, blocks=blocks
+        ):
+            yield from maf.split_windows(self.max_len_no_split)
 
-    def discard_stream(self, position=(), index_range=(0, float("inf"))):
+    def discard_stream(self, position=(), index_range=(0, float("inf")), blocks=None):
         """Sort out small mafs and trim mafs."""
-        for maf in self.split_stream(position=position, index_range=index_range):
+        for maf in self.split_stream(
+            position=position, index_range=index_range, blocks=blocks
+        ):
             if maf.size() - 1 < self.min_size or maf.len_no_gaps() < self.min_length:
                 continue
             maf.clean()
@@ -654,15 +1366,291 @@ class MafStream:
                 continue
             yield maf
 
+    @staticmethod
+    def is_target_break(coordinates, next_coordinates):
+        """Test if the target of two successive blocks is discontinuous.
+
+        No concatenation goes past such a break, whatever was concatenated
+        before, because the target must always be continuous. The stream can
+        therefore be restarted at a break with the same result.
+        """
+        return (
+            coordinates[1] + ALLOWED_DIST < next_coordinates[0]
+            or coordinates[1] > next_coordinates[0]
+        )
+
+    def target_breaks(self):
+        """Iterate over the target breaks of the file, see is_target_break().
+
+        Only the raw coordinates are read. Yields block index and offset of
+        every block that starts after a break, the first block included.
+        """
+        coordinates = None
+        for block_index, off_set, raw_block in self.raw_blocks():
+            next_coordinates = raw_block_coordinates(raw_block)
+            if coordinates is None or self.is_target_break(coordinates, next_coordinates):
+                yield block_index, off_set
+            coordinates = next_coordinates
+
+    def iterate_shard(self, start, stop_block_index=None):
+        """Iterate over the blocks of a shard of the file.
+
+        A shard starts at a target break, given as block index and offset,
+        and ends before the block at stop_block_index, which should also be a
+        target break. That block is yielded as well, it makes the
+        concatenation yield the last block of the shard, but nothing is
+        concatenated to it.
+
+        :param tuple start: Block index and offset of the first block.
+        :param int stop_block_index: First block of the next shard, None for
+            the end of the file.
+        """
+        for block_index, _off_set, raw_block in self.raw_blocks(*start):
+            maf = MafBlock(raw_block)
+            maf.add_index(block_index)
+            yield maf
+            if stop_block_index is not None and block_index >= stop_block_index:
+                break
+
+    def _query_start(self, start):
+        """Get block index and offset of the last target break before start."""
+        checkpoint = 0 if self.index is None else self.index.checkpoint_at_position(start)
+        while True:
+            first = (0, 0) if self.index is None else self.index.get_checkpoint(checkpoint)
+            # The start of the file is a break
+            restart = first if first == (0, 0) else None
+            coordinates = None
+            for block_index, off_set, raw_block in self.raw_blocks(*first):
+                next_coordinates = raw_block_coordinates(raw_block)
+                if next_coordinates[0] > start:
+                    break
+                if coordinates is not None and self.is_target_break(
+                    coordinates, next_coordinates
+                ):
+                    restart = block_index, off_set
+                coordinates = next_coordinates
+            if restart is not None:
+                return restart
+            # No break between checkpoint and start, look further back
+            checkpoint -= 1
+
+    def _query_blocks(self, start, end):
+        """Get the blocks from the last target break before start to the first after end."""
+        coordinates = None
+        for block_index, _off_set, raw_block in self.raw_blocks(*self._query_start(start)):
+            next_coordinates = raw_block_coordinates(raw_block)
+            maf = MafBlock(raw_block)
+            maf.add_index(block_index)
+            yield maf
+            # The first block after the break is still needed, it makes the
+            # concatenation yield the block before the break.
+            if (
+                coordinates is not None
+                and next_coordinates[0] > end
+                and self.is_target_break(coordinates, next_coordinates)
+            ):
+                break
+            coordinates = next_coordinates
+
+    def query(self, start, end):
+        """Get the preprocessed maf blocks overlapping a target region.
+
+        Gives the same blocks as filtering discard_stream() for the region but
+        only processes the neighbourhood of the region: from the last target
+        break before start to the first target break after end. The break
+        before start is found with the target starts of the index if the file
+        is indexed, see MafIndex.
+
+        :param int start: Start of region on target.
+        :param int end: End of region on target.
+        """
+        for maf in self.discard_stream(blocks=self._query_blocks(start, end)):
+            start_maf, end_maf = maf.coordinates()
+            # (StartA <= EndB) and (EndA >= StartB)
+            if start <= end_maf and end >= start_maf:
+                yield maf
+
+    def _concat_step(self, maf, next_maf):
+        """Concatenate next_maf to maf if concat_blocks() would.
+
+        Species are deleted if one of the two blocks is shorter than
+        min_length_del. If only next_maf is short it depends on the look ahead
+        from next_maf, see _resolve_look_ahead().
+
+        :return: True if concatenated, False if the concatenation ends here,
+            None if it depends on the look ahead.
+        """
+        return_value = maf.concat(next_maf)
+        # Return value is zero if concatenation was successful
+        if return_value == 0:
+            return True
+        # The returned negative int says how many species imped a
+        # concatenation.
+        if return_value < -self.max_del_species:
+            return False
+        # Test if the current maf block is to small
+        if maf.len_no_gaps() < self.min_length_del:
+            maf.concat(next_maf, max_del=self.max_del_species)
+            return True
+        # Test if the next maf block is to small
+        if next_maf.len_no_gaps() < self.min_length_del:
+            return None
+        # If both blocks are sufficiently big keep current block.
+        return False
+
+    def _resolve_look_ahead(self, maf, next_maf, block_index, future):
+        """Finish _concat_step() with the look ahead of next_maf.
+
+        :param int block_index: Block index of next_maf.
+        :param tuple future: End block index and block of the look ahead.
+        :return: True if concatenated, False if the concatenation ends here.
+        """
+        # Test if the next block can also not be extend to become big enough.
+        if future[1].len_no_gaps() < self.min_length_del:
+            maf.concat(next_maf, max_del=self.max_del_species)
+            return True
+        # Safe future maf, the concatenation continues with it.
+        self.block_dic[block_index] = future
+        return False
+
+    def _look_ahead(self, window, block_index):
+        """Concatenate blocks from block_index on until the concatenation ends.
+
+        Like concat_blocks() with only_block, the nested look aheads are kept
+        as a stack of frames instead of recursion. A frame is the block
+        concatenated so far, the block index of the next block and the next
+        block while it waits for a nested look ahead.
+
+        :return: Block index the concatenation ended at, the last block index
+            at the end of the file, and the concatenated block.
+        :rtype: tuple
+        """
+        future = self.block_dic.get(block_index)
+        if future is not None:
+            return future
+        frames = [[window.get(block_index), block_index + 1, None]]
+        future = None
+        while True:
+            frame = frames[-1]
+            maf, next_index, next_maf = frame
+            if future is not None:
+                concatenated = self._resolve_look_ahead(maf, next_maf, next_index, future)
+                future = None
+            else:
+                next_maf = window.get(next_index)
+                if next_maf is None:
+                    concatenated = False
+                    next_index -= 1
+                # Only first iteration, a block without sequences is skipped
+                elif maf.is_empty():
+                    future = self.block_dic.get(next_index)
+                    if future is not None:
+                        concatenated = False
+                        next_index, maf = future
+                        future = None
+                    else:
+                        frame[0] = next_maf
+                        concatenated = True
+                else:
+                    concatenated = self._concat_step(maf, next_maf)
+                    if concatenated is None:
+                        frame[2] = next_maf
+                        future = self.block_dic.get(next_index)
+                        if future is None:
+                            frames.append([window.get(next_index), next_index + 1, None])
+                        continue
+            if concatenated:
+                frame[1] += 1
+                continue
+            frames.pop()
+            future = next_index, maf
+            if not frames:
+                return future
+
+    def _jump_look_ahead(self, block_index, maf, next_index):
+        """Continue with the look ahead of block_index if it was kept.
+
+        :param MafBlock maf: Block at block_index.
+        :param int next_index: Block index after block_index.
+        :return: Block to continue with and the next block index.
+        :rtype: tuple
+        """
+        future = self.block_dic.get(block_index)
+        if future is None:
+            return maf, next_index
+        del self.block_dic[block_index]
+        calc_block_index, maf = future
+        return maf, max(next_index, calc_block_index)
+
+    def cache_stats(self):
+        """Get statistics of off_set_dic and block_dic, see LruCache.stats()."""
+        return {"off_set_dic": self.off_set_dic.stats(), "block_dic": self.block_dic.stats()}
+
     def concat_blocks(self, block_index, only_block=True, split=False):
-        """Concatinate blocks starting with a specific block index."""
+        """Concatinate blocks starting with a specific block index.
+
+        A single pass over the file. The look ahead, whether a short block
+        can be concatenated to a block long enough on its own, reads from a
+        RawBlockWindow and its results are kept in the LruCache block_dic.
+        The blocks are the same as from concat_blocks_recursive().
+
+        :param bool only_block: Get only the first concatenated block.
+        :param bool split: Split the blocks with sliding windows.
+        :return: Last block index and the block, or the list of blocks.
+        :rtype: tuple
+        """
+        window = RawBlockWindow(self, block_index, LOOKAHEAD_SIZE)
+        if only_block:
+            return self._look_ahead(window, block_index)
+
+        maf_list = []
+        maf = MafBlock()
+        next_index = last_index = block_index
+        while True:
+            next_maf = window.get(next_index)
+            if next_maf is None:
+                break
+            last_index = next_index
+            next_index += 1
+            # Only first iteration, a block without sequences is skipped
+            if maf.is_empty():
+                maf, next_index = self._jump_look_ahead(last_index, next_maf, next_index)
+                continue
+
+            concatenated = self._concat_step(maf, next_maf)
+            if concatenated is None:
+                concatenated = self._resolve_look_ahead(
+                    maf, next_maf, last_index, self._look_ahead(window, last_index)
+                )
+            if concatenated:
+                continue
+            # Catches lower bound size
+            if maf.size() - 1 < self.min_size and maf.len_no_gaps() < self.min_length:
+                maf = next_maf
+                continue
+            if split:
+                maf_list += maf.preprocess_block(self.max_len_no_split)
+            else:
+                maf_list.append(maf)
+            maf, next_index = self._jump_look_ahead(last_index, next_maf, next_index)
+
+        maf_list.append(maf)
+        return last_index, maf_list
+
+    def concat_blocks_recursive(self, block_index, only_block=True, split=False):
+        """Concatinate blocks starting with a specific block index.
+
+        Every look ahead reads the file again from block_index. Kept as
+        reference for concat_blocks().
+        """
         maf_list = []
         maf = MafBlock()
 
         # might be set if look into the future becomes reality
         calc_block_index = -1
 
-        for block_index, next_maf in self.iterate_from(block_index):
+        for next_maf in self.iterate_from(block_index):
+            block_index = next_maf.block_index_list[0]
             next_maf.add_suffix(f"_block-index_{block_index}")
 
             # This can be triggered if new block starts and the current index
@@ -698,7 +1686,7 @@ class MafStream:
                     elif next_maf.len_no_gaps() < self.min_length_del:
                         # Test if the next block can also not be extend to
                         # become big enough.
-                        end_block_index, future_maf = self.concat_blocks(block_index)
+                        end_block_index, future_maf = self.concat_blocks_recursive(block_index)
                         # Safe future maf if force concatenation is triggered in
                         # does not need to be calculated again.
                         if future_maf.len_no_gaps() < self.min_length_del:
@@ -729,7 +1717,7 @@ class MafStream:
                 # Catches lower bound size
                 if (
                     maf.size() - 1 < self.min_size
-                    and len(maf.block[1][-1].replace("-", "")) < self.min_length
+                    and maf.len_no_gaps() < self.min_length
                 ):
                     maf = next_maf
                     continue
@@ -805,7 +1793,7 @@ class MafStream:
                 # Catches lower bound size
                 if (
                     maf.size() - 1 < self.min_size
-                    and len(maf.block[1][-1].replace("-", "")) < self.min_length
+                    and maf.len_no_gaps() < self.min_length
                 ):
                     maf = next_maf
                     continue
@@ -860,11 +1848,11 @@ class MafStream:
             print()
             print(f"Iteration: {block_index}")
             print(f"Length maf: {len(maf)}")
-            for line in maf.block[1:]:
-                print(f"{line[1]}: {len(line[-1])}")
+            for species in maf.get_all_species():
+                print(f"{species}: {len(maf)}")
             print(f"Length next maf: {len(next_maf)}")
-            for line in next_maf.block[1:]:
-                print(f"{line[1]}: {len(line[-1])}")
+            for species in next_maf.get_all_species():
+                print(f"{species}: {len(next_maf)}")
             append_html("<h3>Current Maf Block</h3>\n")
             maf.generate_html(
                 "/homes/biertruck/john/public_html/mview/", name="test_concat_parts"
@@ -998,7 +1986,7 @@ class MafStream:
                 # Catches lower bound size
                 if (
                     maf.size() - 1 < self.min_size
-                    and len(maf.block[1][-1].replace("-", "")) < self.min_length
+                    and maf.len_no_gaps() < self.min_length
                 ):
                     maf = next_maf
                     continue
@@ -0,0 +1,68 @@
+#!/usr/bin/python3
+"""Journal of the pipeline stages finished per chromosome.
+
+The journal is kept in '<chromosome dir>/pipeline_journal.json'. A finished
+stage stores size and modification time of its input and output files, the
+markers. The stage counts as done as long as all markers still match, hence
+a crash in the middle of a stage, or a later change of a file, makes it run
+again.
+"""
+
+import json
+import os
+
+JOURNAL_FILE = "pipeline_journal.json"
+
+
+def file_marker(file_path):
+    """Get size and modification time of a file, None if it does not exist."""
+    if not os.path.isfile(file_path):
+        return None
+    stat = os.stat(file_path)
+    return [stat.st_size, stat.st_mtime_ns]
+
+
+def read_journal(chromosome_dir_path):
+    """Read journal of a chromosome, empty if there is none."""
+    journal_path = os.path.join(chromosome_dir_path, JOURNAL_FILE)
+    if not os.path.isfile(journal_path):
+        return {}
+    with open(journal_path, "r", encoding="UTF-8") as f_handle:
+        return json.load(f_handle)
+
+
+def write_journal(chromosome_dir_path, journal):
+    """Write journal of a chromosome through a temporary file."""
+    journal_path = os.path.join(chromosome_dir_path, JOURNAL_FILE)
+    with open(journal_path + ".tmp", "w", encoding="UTF-8") as f_handle:
+        json.dump(journal, f_handle, indent=1)
+    os.replace(journal_path + ".tmp", journal_path)
+
+
+def start_stage(chromosome_dir_path, stage):
+    """Mark stage as not done, before its files are changed."""
+    journal = read_journal(chromosome_dir_path)
+    if stage in journal:
+        del journal[stage]
+        write_journal(chromosome_dir_path, journal)
+
+
+def finish_stage(chromosome_dir_path, stage, file_paths):
+    """Mark stage as done with the markers of its files."""
+    journal = read_journal(chromosome_dir_path)
+    journal[stage] = {
+        os.path.relpath(file_path, chromosome_dir_path): file_marker(file_path)
+        for file_path in file_paths
+    }
+    write_journal(chromosome_dir_path, journal)
+
+
+def stage_done(chromosome_dir_path, stage):
+    """Check if stage is done and none of its files changed since."""
+    markers = read_journal(chromosome_dir_path).get(stage)
+    if markers is None:
+        return False
+    return all(
+        file_marker(os.path.join(chromosome_dir_path, file_path)) == marker
+        for file_path, marker in markers.items()
+    )
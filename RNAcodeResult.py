@@ -0,0 +1,111 @@
+#!/usr/bin/python3
+"""Load RNAcode results, written with 'RNAcode -t', as numpy structured arrays.
+
+Each result file is filtered by p value before it is parsed, hence only the
+HSS below the threshold are converted and kept in memory. The p values are
+cut from the bytes of the file with numpy, see last_column().
+"""
+
+import io
+
+import numpy as np
+
+# Columns of the tabular RNAcode output, the width of the text columns is
+# set per file.
+RESULT_COLUMNS = [
+    ("hss_id", np.int64),
+    ("strand", np.str_),
+    ("frame", np.int64),
+    ("length", np.int64),
+    ("from", np.int64),
+    ("to", np.int64),
+    ("name", np.str_),
+    ("start", np.int64),
+    ("end", np.int64),
+    ("score", np.float64),
+    ("p_val", np.float64),
+]
+LOAD_DTYPE = [(name, object if dtype is np.str_ else dtype) for name, dtype in RESULT_COLUMNS]
+
+
+def last_column(data, line_ends):
+    """Get the last column of tab separated lines as float, without splitting them.
+
+    The fields are cut from the bytes into one fixed width array that numpy
+    converts at once.
+
+    :param numpy.ndarray data: The lines as bytes, each ends with a newline.
+    :param numpy.ndarray line_ends: Positions of the newlines.
+    :rtype: numpy.ndarray
+    """
+    tabs = np.flatnonzero(data == ord("\t"))
+    starts = tabs[np.searchsorted(tabs, line_ends) - 1] + 1
+    width = max(1, int((line_ends - starts).max(initial=0)))
+    positions = np.minimum(starts[:, None] + np.arange(width), line_ends[:, None])
+    fields = data[positions]
+    # Bytes after the field are cut off as trailing zeros by the S dtype
+    fields[positions == line_ends[:, None]] = 0
+    return fields.view(f"S{width}").ravel().astype(np.float64)
+
+
+def parse_results(data, p_threshold=float("inf")):
+    """Parse tabular RNAcode output, keep HSS with a p value of at most p_threshold.
+
+    The p values, the last column, are read first. Only the lines that are
+    kept are parsed into all columns with np.loadtxt.
+
+    :param bytes data: Content of a result file.
+    :return: One entry per HSS.
+    :rtype: numpy.ndarray
+    :raise: ValueError if a kept line does not have all columns.
+    """
+    table = np.empty(0, dtype=LOAD_DTYPE)
+    if data.strip():
+        if not data.endswith(b"\n"):
+            data += b"\n"
+        if p_threshold != float("inf"):
+            data = np.frombuffer(data, dtype=np.uint8)
+            line_ends = np.flatnonzero(data == ord("\n"))
+            keep = last_column(data, line_ends) <= p_threshold
+            data = data[np.repeat(keep, np.diff(line_ends, prepend=-1))].tobytes()
+        if data:
+            table = np.loadtxt(
+                io.BytesIO(data), dtype=LOAD_DTYPE, delimiter="\t", comments=None, ndmin=1
+            )
+    # The text columns are loaded as objects, their width is set here
+    columns = {
+        name: table[name].astype(np.str_) if dtype is np.str_ else table[name]
+        for name, dtype in RESULT_COLUMNS
+    }
+    results = np.empty(
+        len(table), dtype=[(name, columns[name].dtype) for name, _dtype in RESULT_COLUMNS]
+    )
+    for name, column in columns.items():
+        results[name] = column
+    return results
+
+
+def read_results(result_file_path, p_threshold=float("inf")):
+    """Read HSS with a p value of at most p_threshold from a result file."""
+    with open(result_file_path, "rb") as f_handle:
+        return parse_results(f_handle.read(), p_threshold)
+
+
+def iterate_results(result_file_paths, p_threshold=float("inf")):
+    """Iterate over the filtered HSS of each result file, one file at a time."""
+    for result_file_path in result_file_paths:
+        yield read_results(result_file_path, p_threshold)
+
+
+def concat_results(result_tables):
+    """Concatenate result tables, text columns are widened to fit all."""
+    result_tables = list(result_tables)
+    if not result_tables:
+        return parse_results(b"")
+    dtype = np.result_type(*[table.dtype for table in result_tables])
+    return np.concatenate([table.astype(dtype, copy=False) for table in result_tables])
+
+
+def load_results(result_file_paths, p_threshold=float("inf")):
+    """Load the filtered HSS of all result files into one table."""
+    return concat_results(iterate_results(result_file_paths, p_threshold))
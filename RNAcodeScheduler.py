@@ -0,0 +1,441 @@
+#!/usr/bin/python3
+"""Run RNAcode on the big blocks or single blocks of a genome alignment in parallel.
+
+Usage: RNAcodeScheduler.py <genome alignment dir> <big_blocks|single_blocks> <num cpus>
+
+Jobs are started longest first so that the largest blocks do not run alone at
+the end. The estimated cost from big_block_costs.json, written by
+stream_chromosome.py, is used if every big block has one, the byte size of the
+maf file otherwise. Failed jobs are retried once. The exit code and runtime of
+every try is kept in a state file per chromosome,
+'<chromosome dir>/<grouping>_state.json'. Jobs that finished in an earlier run
+are skipped, unless their maf file or result changed.
+
+With iterate_preprocessed() the big blocks are run as soon as
+stream_chromosome.py completes them, instead of after all chromosomes are
+preprocessed. They can also be kept in memory and piped to RNAcode, then
+only the big blocks that failed are written to disk.
+"""
+
+import hashlib
+import heapq
+import json
+import multiprocessing
+import os
+import queue
+import re
+import subprocess
+import sys
+from concurrent.futures import ThreadPoolExecutor, FIRST_COMPLETED, wait
+from datetime import datetime
+
+from MafBlock import MafBlock
+from PipelineJournal import file_marker
+import stream_chromosome
+
+# Number of tries before a job is reported as failed.
+MAX_TRIES = 2
+
+# Chromosomes preprocessed at a time by iterate_preprocessed().
+NUM_PRODUCERS = 4
+# Complete big blocks that may wait for a worker before preprocessing pauses.
+MAX_QUEUED = 40
+# Seconds without a big block after which the producers are checked.
+PRODUCER_TIMEOUT = 60
+
+GROUPING_REG_EX = {
+    "big_blocks": re.compile(r"big_block_[0-9]+\.maf"),
+    "single_blocks": re.compile(r"big_block_[0-9]+-s_[0-9]+\.maf"),
+}
+
+
+def read_cost_manifest(chromosome_dir_path):
+    """Read estimated cost of each big block, empty if there is no manifest."""
+    manifest_path = os.path.join(chromosome_dir_path, "big_block_costs.json")
+    if not os.path.isfile(manifest_path):
+        return {}
+    with open(manifest_path, "r", encoding="UTF-8") as f_handle:
+        return json.load(f_handle)
+
+
+def sort_longest_first(maf_paths):
+    """Sort maf files by estimated cost, or by byte size if a cost is missing."""
+    manifests = {}
+    costs = {}
+    for maf_path in maf_paths:
+        chromosome_dir_path = get_chromosome_dir_path(maf_path)
+        if chromosome_dir_path not in manifests:
+            manifests[chromosome_dir_path] = read_cost_manifest(chromosome_dir_path)
+        block = os.path.basename(maf_path).split(".")[0]
+        if block not in manifests[chromosome_dir_path]:
+            costs = None
+            break
+        costs[maf_path] = manifests[chromosome_dir_path][block]
+    if costs is None:
+        costs = {maf_path: os.path.getsize(maf_path) for maf_path in maf_paths}
+    return sorted(maf_paths, key=lambda path: (-costs[path], path))
+
+
+def find_jobs(dir_path, grouping):
+    """Find the maf files of a grouping, longest first.
+
+    :param str dir_path: Genome alignment or chromosome directory.
+    :param str grouping: Either "big_blocks" or "single_blocks".
+    :return: Paths to the maf files.
+    :rtype: list
+    """
+    if grouping not in GROUPING_REG_EX:
+        raise ValueError(f"Error grouping: {grouping} undefined.")
+    reg_pat = GROUPING_REG_EX[grouping]
+    maf_paths = []
+    for root, _dirs, files in os.walk(dir_path):
+        maf_paths += [os.path.join(root, name) for name in files if reg_pat.fullmatch(name)]
+    return sort_longest_first(maf_paths)
+
+
+def get_chromosome_dir_path(maf_path):
+    """Get chromosome dir of a maf file in '<chromosome dir>/big_blocks/'."""
+    return os.path.dirname(os.path.dirname(os.path.abspath(maf_path)))
+
+
+def get_state_path(maf_path, grouping):
+    """Get path of the state file for a maf file in '<chromosome dir>/big_blocks/'."""
+    return os.path.join(get_chromosome_dir_path(maf_path), f"{grouping}_state.json")
+
+
+def read_state(state_path):
+    """Read a state file, empty if it does not exist."""
+    if not os.path.isfile(state_path):
+        return {}
+    with open(state_path, "r", encoding="UTF-8") as f_handle:
+        return json.load(f_handle)
+
+
+def write_state(state_path, state):
+    """Write a state file, a crash never leaves half a file."""
+    with open(state_path + ".tmp", "w", encoding="UTF-8") as f_handle:
+        json.dump(state, f_handle, indent=1)
+    os.replace(state_path + ".tmp", state_path)
+
+
+def failed_jobs(chromosome_dir_path, grouping):
+    """Get the blocks for which all tries failed.
+
+    :return: Block names, like 'big_block_1'.
+    :rtype: list
+    """
+    state = read_state(os.path.join(chromosome_dir_path, f"{grouping}_state.json"))
+    return [block for block, job in state.items() if job["status"] == "failed"]
+
+
+def run_rnacode(maf_path, maf_content=None):
+    """Run RNAcode on one maf file.
+
+    Output goes to '<maf>.res.tsv', '<maf>.out' and '<maf>.err'.
+
+    :param bytes maf_content: Content of the maf file, piped to RNAcode
+        instead of reading maf_path, which need not exist then.
+    :return: Exit code and runtime in seconds.
+    :rtype: tuple
+    """
+    start_time = datetime.now()
+    call = ["RNAcode", "-t", "-o", f"{maf_path}.res.tsv"]
+    if maf_content is None:
+        call.append(maf_path)
+    with open(f"{maf_path}.out", "w", encoding="UTF-8") as out_handle, open(
+        f"{maf_path}.err", "w", encoding="UTF-8"
+    ) as err_handle:
+        completed_process = subprocess.run(
+            call,
+            input=maf_content,
+            stdout=out_handle,
+            stderr=err_handle,
+        )
+    return completed_process.returncode, (datetime.now() - start_time).total_seconds()
+
+
+def maf_marker(maf_path, maf_content=None):
+    """Get marker of a maf file, the md5 checksum for a maf content in memory."""
+    if maf_content is not None:
+        return hashlib.md5(maf_content).hexdigest()
+    return file_marker(maf_path)
+
+
+def job_finished(job, maf_path, maf_content=None):
+    """Check if a job finished and neither the maf file nor the result changed since.
+
+    The markers of both files are stored when the job finishes, see
+    PipelineJournal.file_marker(). A result that was cut off or removed after
+    the job finished does not match.
+    """
+    return (
+        job.get("status") in ("done", "failed")
+        and job.get("maf_marker") == maf_marker(maf_path, maf_content)
+        and job.get("res_marker") == file_marker(f"{maf_path}.res.tsv")
+    )
+
+
+def run_jobs(maf_paths, grouping, num_cpus, max_tries=MAX_TRIES, resume=True):
+    """Run RNAcode on the maf files with a pool of num_cpus workers.
+
+    Jobs are started in the given order and a failed job is queued again
+    until max_tries is reached, before the next new job. The state files are
+    updated after every job. The next maf path is only taken from maf_paths
+    when a worker is free, so maf_paths may be a generator that is still
+    producing them, see iterate_preprocessed().
+
+    Instead of a path an item of maf_paths may be a tuple of path and maf
+    content. The content is piped to RNAcode and only written to the path if
+    all tries failed, for build_single_blocks().
+
+    :param bool resume: Skip jobs that finished in an earlier run, see
+        job_finished().
+    :return: Paths of the maf files for which all tries failed.
+    :rtype: list
+    """
+    states = {}
+    failed = []
+    retries = []
+    maf_contents = {}
+    num_finished = 0
+    maf_paths = iter(maf_paths)
+
+    def next_job():
+        """Get next maf path to run, None if there is none left."""
+        nonlocal num_finished
+        if retries:
+            return retries.pop(0)
+        for maf_path in maf_paths:
+            maf_content = None
+            if isinstance(maf_path, tuple):
+                maf_path, maf_content = maf_path
+            state_path = get_state_path(maf_path, grouping)
+            if state_path not in states:
+                states[state_path] = read_state(state_path)
+            block = os.path.basename(maf_path).split(".")[0]
+            job = states[state_path].get(block, {})
+            if resume and job_finished(job, maf_path, maf_content):
+                num_finished += 1
+                if job["status"] == "failed":
+                    failed.append(maf_path)
+                continue
+            states[state_path][block] = {
+                "maf": maf_path,
+                "size": os.path.getsize(maf_path) if maf_content is None else len(maf_content),
+                "tries": [],
+                "status": "queued",
+            }
+            maf_contents[maf_path] = maf_content
+            return maf_path
+        return None
+
+    with ThreadPoolExecutor(max_workers=num_cpus) as executor:
+        running = {}
+        while True:
+            while len(running) < num_cpus:
+                maf_path = next_job()
+                if maf_path is None:
+                    break
+                running[
+                    executor.submit(run_rnacode, maf_path, maf_contents[maf_path])
+                ] = maf_path
+            if not running:
+                break
+            done, _not_done = wait(running, return_when=FIRST_COMPLETED)
+            for future in done:
+                maf_path = running.pop(future)
+                exit_code, runtime = future.result()
+                state_path = get_state_path(maf_path, grouping)
+                job = states[state_path][os.path.basename(maf_path).split(".")[0]]
+                job["tries"].append({"exit_code": exit_code, "runtime": runtime})
+                if exit_code == 0:
+                    job["status"] = "done"
+                elif len(job["tries"]) < max_tries:
+                    job["status"] = "retry"
+                    retries.append(maf_path)
+                else:
+                    job["status"] = "failed"
+                    failed.append(maf_path)
+                if job["status"] != "retry":
+                    maf_content = maf_contents.pop(maf_path)
+                    if job["status"] == "failed" and maf_content is not None:
+                        with open(maf_path, "wb") as f_handle:
+                            f_handle.write(maf_content)
+                    job["maf_marker"] = maf_marker(maf_path, maf_content)
+                    job["res_marker"] = file_marker(f"{maf_path}.res.tsv")
+                write_state(state_path, states[state_path])
+    if num_finished:
+        print(f"{num_finished} jobs already finished.", flush=True)
+    return failed
+
+
+def produce_big_blocks(maf_file_path, big_block_queue, in_memory=False):
+    """Preprocess a chromosome and put each complete big block on the queue.
+
+    put() blocks while the queue is full, this holds back the preprocessing
+    until RNAcode catches up. A final None marks the end of the chromosome.
+    """
+    try:
+        stream_chromosome.preprocess_chromosome(
+            maf_file_path,
+            on_big_block=lambda maf_path, maf_content: big_block_queue.put(
+                (maf_path, maf_content)
+            ),
+            in_memory=in_memory,
+        )
+    finally:
+        big_block_queue.put(None)
+
+
+def big_block_size(big_block):
+    """Get size in bytes of a big block given as path and content."""
+    maf_path, maf_content = big_block
+    return os.path.getsize(maf_path) if maf_content is None else len(maf_content)
+
+
+def iterate_preprocessed(
+    maf_file_paths, num_producers=NUM_PRODUCERS, max_queued=MAX_QUEUED, in_memory=False
+):
+    """Preprocess chromosomes and yield their big blocks as soon as they are complete.
+
+    num_producers chromosomes are preprocessed at a time, each in its own
+    process. Passed to run_jobs() RNAcode starts on the first big blocks while
+    the preprocessing goes on.
+
+    Of the big blocks that are complete, up to max_queued are held back and
+    the largest is yielded first. Longest first is hence kept within this
+    window, not over the whole genome like with find_jobs().
+
+    :param list maf_file_paths: Paths to the maf files of the chromosomes.
+    :param int max_queued: Maximal number of complete big blocks in the queue,
+        before the producers are held back. As many are held back for the
+        order by size.
+    :param bool in_memory: Do not write the big blocks, their content is
+        passed on in memory.
+    :return: Path and content of each big block, the content is None if the
+        big block was written.
+    :rtype: generator
+    :raise: SystemError if the preprocessing of a chromosome failed.
+    """
+    big_block_queue = multiprocessing.Queue(max_queued)
+    waiting = list(maf_file_paths)
+    producers = []
+    num_running = 0
+    # Complete big blocks by size, the order they came in breaks ties
+    ready = []
+    num_received = 0
+
+    def receive(big_block):
+        """Count a finished producer or keep a big block."""
+        nonlocal num_running, num_received
+        if big_block is None:
+            num_running -= 1
+            return
+        heapq.heappush(ready, (-big_block_size(big_block), num_received, big_block))
+        num_received += 1
+
+    while waiting or num_running or ready:
+        while waiting and num_running < num_producers:
+            producer = multiprocessing.Process(
+                target=produce_big_blocks,
+                args=(waiting.pop(0), big_block_queue, in_memory),
+            )
+            producer.start()
+            producers.append(producer)
+            num_running += 1
+        while len(ready) < max_queued:
+            try:
+                receive(big_block_queue.get_nowait())
+            except queue.Empty:
+                break
+        if ready:
+            yield heapq.heappop(ready)[2]
+            continue
+        if not num_running:
+            continue
+        try:
+            receive(big_block_queue.get(timeout=PRODUCER_TIMEOUT))
+        except queue.Empty:
+            # A producer that was killed never puts its final None
+            num_running = sum(producer.is_alive() for producer in producers)
+
+    for producer in producers:
+        producer.join()
+    if any(producer.exitcode != 0 for producer in producers):
+        raise SystemError("Maf stream parallel failed!")
+
+
+def read_file(file_path):
+    """Get content of a file."""
+    with open(file_path, "r", encoding="UTF-8") as f_handle:
+        return f_handle.read()
+
+
+def remove_stale_single_blocks(chromosome_dir_path, big_block, single_block_paths):
+    """Remove files of single blocks of big_block that are not in single_block_paths.
+
+    Such files are left from an earlier packing, the results are removed too.
+    """
+    big_blocks_dir = f"{chromosome_dir_path}/big_blocks"
+    current = {os.path.basename(path) for path in single_block_paths}
+    for file_name in os.listdir(big_blocks_dir):
+        match = GROUPING_REG_EX["single_blocks"].match(file_name)
+        if (
+            match
+            and file_name.startswith(f"{big_block}-s_")
+            and file_name[:match.end()] not in current
+        ):
+            os.remove(f"{big_blocks_dir}/{file_name}")
+
+
+def build_single_blocks(chromosome_dir_path, failed_twice):
+    """Split big blocks that failed into single maf-blocks.
+
+    Single block files of these big blocks that are not written again, left
+    from an earlier packing, are removed together with their results.
+
+    :return: Paths of the single block maf files.
+    :rtype: list
+    """
+    single_block_paths = []
+    block_index = 0
+    maf = MafBlock()
+    for big_block in failed_twice:
+        with open(
+            f"{chromosome_dir_path}/big_blocks/{big_block}.maf",
+            "r",
+            encoding="UTF-8",
+        ) as f_handle:
+            for line in f_handle:
+                if line == "\n":
+                    block_index += 1
+                    file_path = f"{chromosome_dir_path}/big_blocks/{big_block}-s_{block_index}.maf"
+
+                    # Keep an unchanged file, its job need not run again
+                    if not os.path.isfile(file_path) or read_file(file_path) != str(maf):
+                        with open(file_path, "w", encoding="UTF-8") as s_handle:
+                            s_handle.write(str(maf))
+                    single_block_paths.append(file_path)
+                    maf = MafBlock()
+                else:
+                    maf.add(line)
+        remove_stale_single_blocks(chromosome_dir_path, big_block, single_block_paths)
+    return single_block_paths
+
+
+def main():
+    """Run RNAcode on a grouping of blocks."""
+    dir_path = sys.argv[1]
+    grouping = sys.argv[2]
+    num_cpus = int(sys.argv[3])
+
+    print("Start crunching", flush=True)
+    maf_paths = find_jobs(dir_path, grouping)
+    failed = run_jobs(maf_paths, grouping, num_cpus)
+    if failed:
+        print(f"{len(failed)} jobs failed {MAX_TRIES} times.")
+    print("Finished crunching")
+
+
+if __name__ == "__main__":
+    main()
@@ -5,8 +5,8 @@ from MafBlock import MafStream
 import sys
 import os
 import subprocess
-from main import build_segments
-from main import hss_to_bed_line
+from RNAcodeResult import read_results
+from Segments import build_segments, hss_to_bed_line
 
 # Minimal size and length that a maf block must have to be processed by RNAcode.
 # Absolute lower boundaries
@@ -31,14 +31,7 @@ RNACODE_WORKDIR = "/scr/k61san2/john/RNAcode_by_coordinates"
 
 def get_result_table(result_file):
     """Build table from tsv file generated by RNAcode."""
-    rnacode_res = []
-    with open(result_file, "r", encoding="UTF-8") as f_handle:
-        for line in f_handle.read().split("\n")[:-1]:
-            line = line.split("\t")
-            if float(line[-1]) > P_THRESHOLD:
-                continue
-            rnacode_res.append(line)
-    return rnacode_res
+    return read_results(result_file, P_THRESHOLD)
 
 
 def main():
@@ -77,21 +70,17 @@ def main():
         min_length=MIN_LENGTH,
         max_len_no_split=MAX_LEN_NO_SPLIT,
     )
+    if maf_stream.index is None:
+        print(f"Build index for {maf_file_path}, this is only done once.")
+        maf_stream.build_index()
 
     maf_counter = 0
-    overlap_found = False
     with open(out_maf_path, "w", encoding="UTF-8") as f_handle:
-        for maf in maf_stream.discard_stream(position=(start, end)):
-            start_maf, end_maf = maf.coordinates()
-            # (StartA <= EndB) and (EndA >= StartB)
-            if start <= end_maf and end >= start_maf:
-                overlap_found = True
-                if maf.size() - 1 < MIN_SIZE or maf.len_no_gaps() < MIN_LENGTH:
-                    continue
-                maf_counter += 1
-                f_handle.write(str(maf))
-            elif overlap_found:
-                break
+        for maf in maf_stream.query(start, end):
+            if maf.size() - 1 < MIN_SIZE or maf.len_no_gaps() < MIN_LENGTH:
+                continue
+            maf_counter += 1
+            f_handle.write(str(maf))
 
     if maf_counter == 0:
         print("No overlapping maf blocks found")
@@ -107,7 +96,7 @@ def main():
         sys.exit(1)
 
     result_table = get_result_table(f"{out_dir}/RNAcode_results.tsv")
-    segments = build_segments(result_table, chromosome, list_maf_blocks=False)
+    segments = build_segments(result_table, chromosome)
     bed_lines = hss_to_bed_line(segments)
     with open(bed_file_path, "w", encoding="UTF-8") as f_handle:
         f_handle.write(
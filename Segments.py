@@ -0,0 +1,237 @@
+#!/usr/bin/python3
+"""Merge high scoring segments (HSS) from RNAcode into segments for the bed file.
+
+Overlapping HSS in the same frame are merged. Of overlapping HSS in different
+frames only the one with the best p value is kept, if only_best is set.
+
+The RNAcode results are either lines split into columns or a table from
+RNAcodeResult.
+"""
+
+from math import log
+
+import numpy as np
+
+
+def build_segments(rnacode_res, chromosome, only_best=True):
+    """Build segments from rnacode results as intermediate structure to bed line.
+
+    The HSS are processed ordered by start. Each HSS is compared with the first
+    segment, in order of creation, that overlaps it, as in
+    build_segments_old() with the HSS ordered by start. As no segment starts
+    after the HSS, a segment overlaps it if its end is not before the start of
+    the HSS. A max tree over the segment ends finds the first such segment in
+    O(log n).
+
+    :param rnacode_res: RNAcode result lines, split into columns, or a
+        result table.
+    :param str chromosome: Name of the chromosome.
+    :param bool only_best: Replace a segment by an overlapping HSS in another
+        frame if the HSS has a better p value.
+    :return: Segments as dictionaries.
+    :rtype: list
+    """
+    if isinstance(rnacode_res, np.ndarray):
+        rnacode_res = rnacode_res[np.argsort(rnacode_res["start"], kind="stable")].tolist()
+    else:
+        rnacode_res = sorted(rnacode_res, key=lambda line: int(line[7]))
+    tree_size = 1
+    while tree_size < len(rnacode_res):
+        tree_size *= 2
+    # Leaf tree_size + i holds the end of segment i, inner nodes the maximum
+    # of their children.
+    max_ends = [float("-inf")] * (2 * tree_size)
+
+    def set_end(segment_index, end):
+        node = tree_size + segment_index
+        max_ends[node] = end
+        node //= 2
+        while node:
+            max_ends[node] = max(max_ends[2 * node], max_ends[2 * node + 1])
+            node //= 2
+
+    segments = []
+    for line in rnacode_res:
+        start = int(line[7])
+        end = int(line[8])
+        hss_id = line[0]
+        maf_block = line[6]
+        strand = line[1]
+        p_val = float(line[-1])
+
+        new_segment = {
+            "start": start,
+            "end": end,
+            "strand": strand,
+            "id": f"HSS_{hss_id}-{maf_block}",
+            "chromosome": chromosome,
+            "p_val": p_val,
+        }
+        # if not overlap found simply add
+        if max_ends[1] < start:
+            segments.append(new_segment)
+            set_end(len(segments) - 1, end)
+            continue
+
+        # Find first segment that ends at or after start
+        node = 1
+        while node < tree_size:
+            node = 2 * node if max_ends[2 * node] >= start else 2 * node + 1
+        segment_index = node - tree_size
+        segment = segments[segment_index]
+        # Not same frame
+        if not (
+            segment["strand"] == new_segment["strand"]
+            and segment["start"] % 3 == new_segment["start"] % 3
+        ):
+            # if only best should be kept check if new segment is better
+            # than old one
+            if only_best and segment["p_val"] > new_segment["p_val"]:
+                segments[segment_index] = new_segment
+                set_end(segment_index, end)
+        # Same frame
+        else:
+            segment["start"] = min((segment["start"], new_segment["start"]))
+            segment["end"] = max((segment["end"], new_segment["end"]))
+            segment["id"] += "," + new_segment["id"]
+            segment["p_val"] = min(new_segment["p_val"], segment["p_val"])
+            set_end(segment_index, segment["end"])
+    return segments
+
+
+def build_segments_old(rnacode_res, chromosome, only_best=True):
+    """Build segments from rnacode results as intermediate structure to bed line.
+
+    Quadratic, every HSS is compared with all segments. Kept as reference for
+    build_segments().
+    """
+    segments = []
+    for line in rnacode_res:
+        start = int(line[7])
+        end = int(line[8])
+        hss_id = line[0]
+        maf_block = line[6]
+        strand = line[1]
+        p_val = float(line[-1])
+
+        new_segment = {
+            "start": start,
+            "end": end,
+            "strand": strand,
+            "id": f"HSS_{hss_id}-{maf_block}",
+            "chromosome": chromosome,
+            "p_val": p_val,
+        }
+        for segment in segments:
+            # Check overlap
+            if (
+                new_segment["start"] <= segment[0]["end"]
+                and segment[0]["start"] <= new_segment["end"]
+            ):
+                # Not same frame
+                if not (
+                    segment[0]["strand"] == new_segment["strand"]
+                    and segment[0]["start"] % 3 == new_segment["start"] % 3
+                ):
+                    # if only best should be kept check if new segment is better
+                    # than old one
+                    if only_best and segment[0]["p_val"] > new_segment["p_val"]:
+                        segment[0] = new_segment
+                    break
+                # Same frame
+                else:
+                    segment[0]["start"] = min((segment[0]["start"], new_segment["start"]))
+                    segment[0]["end"] = max((segment[0]["end"], new_segment["end"]))
+                    segment[0]["id"] += "," + new_segment["id"]
+                    segment[0]["p_val"] = min(new_segment["p_val"], segment[0]["p_val"])
+                    break
+        # if not overlap found simply add
+        else:
+            segments.append([new_segment])
+    return [seg[0] for seg in segments]
+
+
+def hss_to_segments(rnacode_res, chromosome):
+    """Get a segment for each HSS of a result table, without merging."""
+    return [
+        {
+            "start": int(start),
+            "end": int(end),
+            "strand": str(strand),
+            "id": f"HSS_{hss_id}-{maf_block}",
+            "chromosome": chromosome,
+            "p_val": float(p_val),
+        }
+        for hss_id, strand, maf_block, start, end, p_val in zip(
+            rnacode_res["hss_id"].tolist(),
+            rnacode_res["strand"].tolist(),
+            rnacode_res["name"].tolist(),
+            rnacode_res["start"].tolist(),
+            rnacode_res["end"].tolist(),
+            rnacode_res["p_val"].tolist(),
+        )
+    ]
+
+
+def hss_to_bed_line(segments, chromosome=None):
+    """Convert a list of high scoring segments from RNAcode to a bed line.
+
+    :param segments: Segments from build_segments(), or a result table,
+        then each HSS is a segment.
+    :param str chromosome: Name of the chromosome, only for a result table.
+    """
+    if isinstance(segments, np.ndarray):
+        segments = hss_to_segments(segments, chromosome)
+    block_count = 1
+    block_starts = 0
+    exp_ids = 1
+    exp_count = 1
+
+    frame_color_dic = {}
+    # frame 1 red
+    frame_color_dic[1] = ["255,128,128", "255,26,26"]
+    # frame 2 blue
+    frame_color_dic[2] = ["128,128,255", "26,26,255"]
+    # frame 3 green
+    frame_color_dic[3] = ["153,230,153", "45,185,45"]
+    # frame 4 purple
+    frame_color_dic[4] = ["223,128,255", "172,0,230"]
+    # frame 5 orange
+    frame_color_dic[5] = ["255,191,128", "230,115,0"]
+    # frame 6 turquoise
+    frame_color_dic[6] = ["128,255,229", "0,230,184"]
+
+    lines = []
+    for segment in segments:
+        p_val = segment["p_val"] if segment["p_val"] > 0 else 0.000001
+        score = min(int(log(p_val, 2) * -1), 1000)
+        name = segment["id"]
+        thick_end = chrom_end = segment["end"] + 1
+        thick_start = chrom_start = segment["start"]
+        if segment["strand"] == "-1":
+            frame = chrom_start % 3 + 4
+        else:
+            frame = chrom_start % 3 + 1
+        quality = 0 if segment["p_val"] > 0.001 else 1
+
+        item_rgb = frame_color_dic[frame][quality]
+        block_sizes = chrom_end - chrom_start
+        lines.append(
+            [
+                segment["chromosome"],
+                chrom_start,
+                chrom_end,
+                name,
+                score,
+                segment["strand"],
+                thick_start,
+                thick_end,
+                item_rgb,
+                block_count,
+                block_sizes,
+                block_starts,
+                exp_count,
+                exp_ids,
+            ]
+        )
+    return lines
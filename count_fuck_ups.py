@@ -49,7 +49,7 @@ def get_chrom_size(maf_file_path):
         max_len_no_split=MAX_LEN_NO_SPLIT,
     )
     for maf in maf_stream:
-        return maf.block[1][5]
+        return maf.src_sizes[0]
 
 
 for chromosome in glob(MULTIZ100WAY_DIR + "/*"):
@@ -70,9 +70,9 @@ for chromosome in glob(MULTIZ100WAY_DIR + "/*"):
         )
         for maf in maf_stream.iterate_from(0):
             maf_count += 1
-            if maf.block[1][5] != correct_chromsize:
+            if maf.src_sizes[0] != correct_chromsize:
                 fuck_up_count += 1
-                fuck_up_list.append(maf.block[1][1])
+                fuck_up_list.append(maf.get_target())
 
 print(fuck_up_count)
 print(maf_count)
@@ -19,10 +19,14 @@ import sys
 import subprocess
 from glob import glob
 from datetime import datetime
-import re
-from math import log
+from multiprocessing import Pool
 
-from MafBlock import MafBlock
+import RNAcodeScheduler
+from Downloader import ChecksumCache, download_file, download_files, file_md5
+from PipelineJournal import finish_stage, stage_done
+from HssScoreStore import HssScoreStore
+from RNAcodeResult import load_results
+from Segments import build_segments, hss_to_bed_line
 
 
 with open("./parameters_local.json", "r", encoding="UTF-8") as file_handle:
@@ -36,6 +40,17 @@ MULTIZ20WAY_WEB_FTP = parameters["MULTIZ20WAY_WEB_FTP"]
 # Parameters for preprocessing can be found stream_chromosome.py
 P_THRESHOLD = 0.01
 NUM_CPUS = 20
+# Pipe the big blocks to RNAcode instead of writing them to the scratch disk,
+# only big blocks that failed are written for the single block retry. The
+# preprocessing is not journaled then, after a crash every chromosome whose
+# RNAcode stage did not finish is preprocessed again.
+PIPE_BIG_BLOCKS = False
+# Results and P_THRESHOLD of the last bed file built per chromosome
+BED_MANIFEST = "bed_manifest.json"
+# Genome wide p values of the HSS, see HssScoreStore
+HSS_SCORE_STORE = "hss_scores"
+# Verified checksums of the maf files, see Downloader.ChecksumCache
+CHECKSUM_CACHE = "checksum_cache.json"
 
 MULTIZ100WAY_DIR = DATA_DIR + "/multiz100way/"
 MULTIZ100WAY_DIR_OLD = DATA_DIR_OLD + "/multiz100way/"
@@ -61,51 +76,34 @@ def system_call(call_str, env=None):
         return process.returncode, process.communicate()[0].decode("UTF-8")
 
 
-def download_maf_file(chromosome_dir, maf_file, ftp_url, checksum_maf_file):
-    """Download maf file."""
-    if os.path.isfile(f"{chromosome_dir}/{maf_file}"):
-        call = f"md5sum {chromosome_dir}/{maf_file}"
-        md5sum_maf = system_call(call)[1].split()[0]
-        if md5sum_maf != checksum_maf_file:
-            print(f"{maf_file} corupt! Redownload")
-            os.remove(f"{chromosome_dir}/{maf_file}")
-            out = system_call(f"wget -nv -P {chromosome_dir} {ftp_url}/{maf_file}")
-            if out[0] != 0:
-                eprint("ERROR!")
-                eprint(f"Downloading {maf_file} failed")
-                eprint(out[1])
-                sys.exit(1)
-            else:
-                print(f"{maf_file} downloaded.")
-            call = f"md5sum {chromosome_dir}/{maf_file}"
-            md5sum_maf = system_call(call)[1].split()[0]
-            if md5sum_maf != checksum_maf_file:
-                print(f"{maf_file} corupt!")
-                sys.exit(1)
-        else:
-            print(f"{maf_file} already downloaded")
-    else:
+def check_maf_file(chromosome_dir, maf_file, checksum_maf_file, checksum_cache, verify=False):
+    """Check if maf file is downloaded and not corrupt, a corrupt one is removed.
+
+    The checksum is only computed if the file changed since the last check,
+    or if verify is set.
+    """
+    maf_file_path = f"{chromosome_dir}/{maf_file}"
+    if not os.path.isfile(maf_file_path):
         print(f"{maf_file} not downloaded")
-        out = system_call(f"wget -nv -P {chromosome_dir} {ftp_url}/{maf_file}")
-        if out[0] != 0:
-            eprint("ERROR!")
-            eprint(f"Downloading {maf_file} failed")
-            eprint(out[1])
-            sys.exit(1)
-        else:
-            print(out[1])
-            print(f"{maf_file} downloaded.")
+        return False
+    if checksum_cache.get_md5(maf_file_path, verify) != checksum_maf_file:
+        print(f"{maf_file} corupt! Redownload")
+        os.remove(maf_file_path)
+        checksum_cache.remove(maf_file_path)
+        return False
+    print(f"{maf_file} already downloaded")
+    return True
 
-        call = f"md5sum {chromosome_dir}/{maf_file}"
-        md5sum_maf = system_call(call)[1].split()[0]
-        if md5sum_maf != checksum_maf_file:
-            print(f"{maf_file} corupt!")
-            sys.exit(1)
-    sys.stdout.flush()
 
+def init_work_dir(dir_path, ftp_url, verify=False):
+    """Set up the working directory.
+
+    Missing maf files are downloaded concurrently, see Downloader. Checksums
+    of downloaded files are kept in CHECKSUM_CACHE.
 
-def init_work_dir(dir_path, ftp_url):
-    """Set up the working directory."""
+    :param bool verify: Compute checksums of all maf files, even of those
+        that did not change.
+    """
     print("Init working directory.")
     check_sum_file_path = f"{dir_path}/md5sum.txt"
 
@@ -113,55 +111,95 @@ def init_work_dir(dir_path, ftp_url):
         os.mkdir(dir_path)
 
     if not os.path.isfile(check_sum_file_path):
-        call = f"wget -nv -P {dir_path} {ftp_url}/md5sum.txt"
-        out = system_call(f"wget -nv -P {dir_path} {ftp_url}/md5sum.txt")
-        if out[0] != 0:
+        try:
+            download_file(f"{ftp_url}/md5sum.txt", check_sum_file_path)
+        except ConnectionError as error:
             eprint("ERROR!")
             eprint("Downloading chechsum file failed")
-            eprint(out[1])
-            eprint(call)
+            eprint(error)
             sys.exit(1)
 
+    checksum_cache = ChecksumCache(f"{dir_path}/{CHECKSUM_CACHE}")
     checksum_dic = {}
     with open(check_sum_file_path, "r", encoding="UTF-8") as f_handle:
         checksum_dic = {line.split()[1]: line.split()[0] for line in f_handle}
 
-    out = system_call(f"curl -ls {ftp_url}")
-    if out[0] != 0:
-        eprint("ERROR!")
-        eprint("Retrieving file list failed!")
-        eprint(out[1])
-        sys.exit(1)
-    maf_file_list = out[1].split("\n")
-
-    for maf_file in maf_file_list:
+    downloads = []
+    for maf_file, checksum_maf_file in checksum_dic.items():
         if ".maf.gz" not in maf_file:
             continue
         chromosome = maf_file.split(".")[0]
         chromosome_dir = f"{dir_path}/{chromosome}"
         if not os.path.isdir(chromosome_dir):
             os.mkdir(chromosome_dir)
-        download_maf_file(chromosome_dir, maf_file, ftp_url, checksum_dic[maf_file])
+        if not check_maf_file(
+            chromosome_dir, maf_file, checksum_maf_file, checksum_cache, verify
+        ):
+            downloads.append(
+                (f"{ftp_url}/{maf_file}", f"{chromosome_dir}/{maf_file}", checksum_maf_file)
+            )
+    sys.stdout.flush()
+
+    failed = download_files(downloads)
+    for _url, maf_file_path, checksum_maf_file in downloads:
+        if maf_file_path not in failed:
+            checksum_cache.add(maf_file_path, checksum_maf_file)
+    checksum_cache.save()
+    if failed:
+        eprint("ERROR!")
+        for maf_file_path, error in failed.items():
+            eprint(f"Downloading {os.path.basename(maf_file_path)} failed")
+            eprint(error)
+        sys.exit(1)
     print("Finished building working directory")
 
 
 def compute_genome_alignment_big_blocks(genome_alignment_dir):
-    """Compute maf file."""
-    print("Concating and spliting genome.")
-    start_time_maf_stream = datetime.now()
-    call_str = f"./stream_chromosome_parallel.sh {genome_alignment_dir} {NUM_CPUS}"
-    completed_process = subprocess.run(call_str.split(), capture_output=True, text=True)
-    if completed_process.returncode != 0:
-        eprint(completed_process.stderr)
-        raise SystemError("Maf stream parallel failed!")
-    print(f"Finished preprocessing after {datetime.now() - start_time_maf_stream}.")
-
+    """Compute maf file.
+
+    RNAcode starts on the big blocks of a chromosome as soon as
+    stream_chromosome.py completes them, see
+    RNAcodeScheduler.iterate_preprocessed(). Chromosomes that are already
+    preprocessed are skipped by stream_chromosome.py, big blocks that already
+    finished by the scheduler. With PIPE_BIG_BLOCKS every chromosome with
+    an unfinished RNAcode stage is preprocessed again, in memory.
+    """
+    print("Concating and spliting genome and running RNAcode.")
     start_time_rnacode = datetime.now()
-    call_str = f"./RNAcode_parallel.sh {genome_alignment_dir} big_blocks {NUM_CPUS}"
-    completed_process = subprocess.run(call_str.split(), capture_output=True, text=True)
-    if completed_process.returncode != 0:
-        eprint(completed_process.stderr)
-        raise SystemError("RNAcode parallel failed!")
+    maf_file_paths = sorted(
+        glob(f"{genome_alignment_dir}/*/*.maf.gz"), key=os.path.getsize, reverse=True
+    )
+    maf_file_paths = [
+        maf_file_path
+        for maf_file_path in maf_file_paths
+        if not stage_done(os.path.dirname(maf_file_path), "rnacode")
+    ]
+    big_block_paths = []
+
+    def iterate_big_blocks():
+        for maf_path, maf_content in RNAcodeScheduler.iterate_preprocessed(
+            maf_file_paths, in_memory=PIPE_BIG_BLOCKS
+        ):
+            big_block_paths.append(maf_path)
+            yield maf_path, maf_content
+
+    failed = RNAcodeScheduler.run_jobs(iterate_big_blocks(), "big_blocks", NUM_CPUS)
+    if failed:
+        print(f"{len(failed)} big blocks failed twice.")
+
+    chromosome_big_block_paths = {}
+    for maf_path in big_block_paths:
+        chromosome_big_block_paths.setdefault(
+            RNAcodeScheduler.get_chromosome_dir_path(maf_path), []
+        ).append(maf_path)
+    for chromosome_dir_path, maf_paths in chromosome_big_block_paths.items():
+        finish_stage(
+            chromosome_dir_path,
+            "rnacode",
+            [f"{chromosome_dir_path}/big_blocks_state.json"]
+            + maf_paths
+            + [f"{maf_path}.res.tsv" for maf_path in maf_paths],
+        )
 
     print(
         f"Finished RNAcode analysis after {datetime.now() - start_time_rnacode}."
@@ -193,76 +231,37 @@ def check_errors_rnacode(genome_alignment_dir):
 
 
 def find_failed_twice(chromosome_dir_path, block_type="big_block"):
-    """Check parallel log for double fails."""
+    """Check scheduler state for blocks for which both tries failed."""
     if block_type == "big_block":
-        reg_pat = re.compile(r"big_block_[0-9]+\.maf")
-        log_file = f"{chromosome_dir_path}/big_blocks_parallel.log"
+        grouping = "big_blocks"
     elif block_type == "single_block":
-        reg_pat = re.compile(r"big_block_[0-9]+-s_[0-9]+\.maf")
-        log_file = f"{chromosome_dir_path}/single_blocks_parallel.log"
+        grouping = "single_blocks"
     else:
         raise ValueError(
             f'Block type must be either "big_block" or "single_block". Not {block_type}'
         )
-
-    failed_blocks = []
-    failed_twice = []
-    if not os.path.isfile(log_file):
-        return failed_twice
-
-    with open(log_file, "r", encoding="UTF-8") as f_handle:
-        log_file_content = f_handle.read().split("\n")
-        for line in log_file_content[1:-1]:
-            exitval = int(line.split()[6])
-            if exitval != 0:
-                try:
-                    block = reg_pat.findall(line)[0].split(".")[0]
-                except IndexError:
-                    print(f"Error can not find {block_type.replace('_', ' ')} in line")
-                    print(line)
-                    continue
-                    # sys.exit(1)
-                if block in failed_blocks:
-                    failed_twice.append(block)
-                else:
-                    failed_blocks.append(block)
-
-    return failed_twice
-
-
-def build_single_blocks(chromosome_dir_path, failed_twice):
-    """Split big blocks that failed into single maf-blocks."""
-    block_index = 0
-    maf = MafBlock()
-    for big_block in failed_twice:
-        with open(
-            f"{chromosome_dir_path}/big_blocks/{big_block}.maf",
-            "r",
-            encoding="UTF-8",
-        ) as f_handle:
-            for line in f_handle:
-                if line == "\n":
-                    block_index += 1
-                    file_path = f"{chromosome_dir_path}/big_blocks/{big_block}-s_{block_index}.maf"
-
-                    with open(file_path, "w", encoding="UTF-8") as f_handle:
-                        f_handle.write(str(maf))
-                    maf = MafBlock()
-                else:
-                    maf.add(line)
+    return RNAcodeScheduler.failed_jobs(chromosome_dir_path, grouping)
 
 
 def check_failed_and_retry(genome_alignment_dir):
-    """Check logs of all big maf-blocks and retry as single block."""
+    """Check state of all big maf-blocks and retry as single block.
+
+    Chromosomes for which the retry is done are skipped.
+    """
     print("Check for big blocks which failed twice")
     start_time_rnacode = datetime.now()
+    single_block_paths = []
+    chromosome_dir_paths = []
     for chromosome in os.listdir(genome_alignment_dir):
         if not os.path.isdir(genome_alignment_dir + "/" + chromosome):
             continue
 
         print(chromosome, flush=True)
-        start_time_chromosome = datetime.now()
         chromosome_dir_path = f"{genome_alignment_dir}/{chromosome}/"
+        if stage_done(chromosome_dir_path, "retry"):
+            print("Retry already done")
+            continue
+        chromosome_dir_paths.append(chromosome_dir_path)
 
         failed_twice = find_failed_twice(chromosome_dir_path)
         if len(failed_twice) == 0:
@@ -272,213 +271,212 @@ def check_failed_and_retry(genome_alignment_dir):
         print("The following blocks failed twice:")
         print("\n".join(failed_twice))
 
-        build_single_blocks(chromosome_dir_path, failed_twice)
-        print("Compute single blocks.")
-        call = f"./RNAcode_parallel.sh {chromosome_dir_path} single_blocks {NUM_CPUS}"
-        out = system_call(call)
-        if out[0] != 0:
-            eprint("Error parallel")
-            eprint(out[1])
-        print(
-            f"Finished chromosome single blocks after {datetime.now() - start_time_chromosome}."
+        single_block_paths += RNAcodeScheduler.build_single_blocks(
+            chromosome_dir_path, failed_twice
+        )
+
+    print("Compute single blocks.")
+    failed = RNAcodeScheduler.run_jobs(
+        RNAcodeScheduler.sort_longest_first(single_block_paths), "single_blocks", NUM_CPUS
+    )
+    if failed:
+        eprint(f"{len(failed)} single blocks failed twice")
+
+    for chromosome_dir_path in chromosome_dir_paths:
+        finish_stage(
+            chromosome_dir_path,
+            "retry",
+            [
+                f"{chromosome_dir_path}/big_blocks_state.json",
+                f"{chromosome_dir_path}/single_blocks_state.json",
+            ],
         )
     print(
         f"Finished computing genome allignment after {datetime.now() - start_time_rnacode}."
     )
 
 
-def build_segments(rnacode_res, chromosome, only_best=True):
-    """Build segments from rnacode results as intermediate structure to bed line."""
-    segments = []
-    for line in rnacode_res:
-        start = int(line[7])
-        end = int(line[8])
-        hss_id = line[0]
-        maf_block = line[6]
-        strand = line[1]
-        p_val = float(line[-1])
-
-        new_segment = {
-            "start": start,
-            "end": end,
-            "strand": strand,
-            "id": f"HSS_{hss_id}-{maf_block}",
-            "chromosome": chromosome,
-            "p_val": p_val,
-        }
-        for segment in segments:
-            # Check overlap
-            if (
-                new_segment["start"] <= segment[0]["end"]
-                and segment[0]["start"] <= new_segment["end"]
-            ):
-                # Not same frame
-                if not (
-                    segment[0]["strand"] == new_segment["strand"]
-                    and segment[0]["start"] % 3 == new_segment["start"] % 3
-                ):
-                    # if only best should be kept check if new segment is better
-                    # than old one
-                    if only_best and segment[0]["p_val"] > new_segment["p_val"]:
-                        segment[0] = new_segment
-                    break
-                # Same frame
-                else:
-                    segment[0]["start"] = min((segment[0]["start"], new_segment["start"]))
-                    segment[0]["end"] = max((segment[0]["end"], new_segment["end"]))
-                    segment[0]["id"] += "," + new_segment["id"]
-                    segment[0]["p_val"] = min(new_segment["p_val"], segment[0]["p_val"])
-                    break
-        # if not overlap found simply add
-        else:
-            segments.append([new_segment])
-    return [seg[0] for seg in segments]
+def get_result_file_paths(chromosome_dir_path):
+    """Get the RNAcode result files of the current big blocks of a chromosome.
 
+    The big blocks are those of big_block_costs.json from the last
+    preprocessing, with the single blocks of those that failed twice.
+    Results of an earlier packing that are still in big_blocks are left
+    out. Without big_block_costs.json all results are taken.
+    """
+    big_blocks_dir = f"{chromosome_dir_path}/big_blocks"
+    big_blocks = RNAcodeScheduler.read_cost_manifest(chromosome_dir_path)
+    if not big_blocks:
+        return sorted(glob(f"{big_blocks_dir}/*res.tsv"))
+    failed_twice = set(find_failed_twice(chromosome_dir_path))
+    rnacode_res_file_paths = []
+    for big_block in big_blocks:
+        rnacode_res_file_paths.append(f"{big_blocks_dir}/{big_block}.maf.res.tsv")
+        if big_block in failed_twice:
+            rnacode_res_file_paths += glob(f"{big_blocks_dir}/{big_block}-s_*.maf.res.tsv")
+    return sorted(path for path in rnacode_res_file_paths if os.path.isfile(path))
+
+
+def get_bed_manifest(chromosome_dir_path, old_manifest):
+    """Get modification time, size and md5 checksum of the RNAcode results.
+
+    The checksum of a file with the same modification time and size as in the
+    old manifest is taken from there.
+    """
+    old_files = old_manifest.get("files", {})
+    files = {}
+    for rnacode_res_file_path in get_result_file_paths(chromosome_dir_path):
+        name = os.path.basename(rnacode_res_file_path)
+        stat = os.stat(rnacode_res_file_path)
+        if name in old_files and old_files[name][:2] == [stat.st_mtime_ns, stat.st_size]:
+            files[name] = old_files[name]
+        else:
+            files[name] = [stat.st_mtime_ns, stat.st_size, file_md5(rnacode_res_file_path)]
+    return {"p_threshold": P_THRESHOLD, "files": files}
 
-def build_bed(genome_alignment_dir):
-    """Build bed file from RNAcode results."""
-    print("Build bed file")
-    genome_bed_file_path = f"{genome_alignment_dir}/RNAcode.bed"
-    if os.path.isfile(genome_bed_file_path):
-        os.remove(genome_bed_file_path)
 
-    bad_maf_file_path = "./bad_maf_blocks.txt"
+def write_bed_manifest(manifest_path, manifest):
+    """Write manifest through a temporary file."""
+    with open(manifest_path + ".tmp", "w", encoding="UTF-8") as f_handle:
+        json.dump(manifest, f_handle)
+    os.replace(manifest_path + ".tmp", manifest_path)
 
-    if os.path.isfile(bad_maf_file_path):
-        os.remove(bad_maf_file_path)
 
-    for chromosome in os.listdir(genome_alignment_dir):
-        if not os.path.isdir(genome_alignment_dir + "/" + chromosome):
-            continue
-        print(f"Processing {chromosome}")
-        chromosome_dir_path = f"{genome_alignment_dir}/{chromosome}/"
-        bed_file_path = f"{chromosome_dir_path}/RNAcode.bed"
-        hss_score_dic_path = f"{chromosome_dir_path}/hss_score_dic.json"
-
-        # failed_twice = find_failed_twice(chromosome_dir_path, block_type="single_block")
-        # # Note single maf blocks which failed twice
-        # with open(bad_maf_file_path, "a", encoding="UTF-8") as f_handle:
-        #     f_handle.write(
-        #         "\n".join(
-        #             [
-        #                 f"{genome_alignment_dir}big_blocks/{mb}.maf"
-        #                 for mb in failed_twice
-        #             ]
-        #         )
-        #         + "\n"
-        #     )
-        # failed_twice += find_failed_twice(chromosome_dir_path, block_type="big_block")
-        # # if len(failed_twice) != 0:
-        # #     print(f"The following blocks failed twice {', '.join(failed_twice)}")
-
-        print("Collect RNAcode results")
-        rnacode_res = []
-        for rnacode_res_file_path in glob(f"{chromosome_dir_path}/big_blocks/*res.tsv"):
-            # block = rnacode_res_file_path.split("/")[-1].replace(".maf.res.tsv", "")
-            # if block in failed_twice:
-            #     # print(f"{block} failed twice.")
-            #     continue
-            with open(rnacode_res_file_path, "r", encoding="UTF-8") as f_handle:
-                for line in f_handle.read().split("\n")[:-1]:
-                    line = line.split("\t")
-                    if float(line[-1]) > P_THRESHOLD:
-                        continue
-                    rnacode_res.append(line)
+def build_bed_chromosome(chromosome_dir_path):
+    """Build bed file and hss score dic of one chromosome from RNAcode results.
 
-        print("Build segments")
-        segments = build_segments(rnacode_res, chromosome)
+    Nothing is done if the results and P_THRESHOLD did not change since the
+    last build, according to BED_MANIFEST.
 
-        hss_score_dic = {
-            seg["id"]: seg["p_val"]
-            for seg in segments
-        }
+    :return: True if the bed file was built.
+    :rtype: bool
+    """
+    chromosome = os.path.basename(os.path.normpath(chromosome_dir_path))
+    bed_file_path = f"{chromosome_dir_path}/RNAcode.bed"
+    hss_score_dic_path = f"{chromosome_dir_path}/hss_score_dic.json"
+    manifest_path = f"{chromosome_dir_path}/{BED_MANIFEST}"
+
+    old_manifest = {}
+    if os.path.isfile(manifest_path):
+        with open(manifest_path, "r", encoding="UTF-8") as f_handle:
+            old_manifest = json.load(f_handle)
+    manifest = get_bed_manifest(chromosome_dir_path, old_manifest)
+    if (
+        manifest["p_threshold"] == old_manifest.get("p_threshold")
+        and {name: state[2] for name, state in manifest["files"].items()}
+        == {name: state[2] for name, state in old_manifest.get("files", {}).items()}
+        and os.path.isfile(bed_file_path)
+        and os.path.isfile(hss_score_dic_path)
+    ):
+        # Only touched, keep the checksums for the next time
+        if manifest != old_manifest:
+            write_bed_manifest(manifest_path, manifest)
+        return False
+
+    # failed_twice = find_failed_twice(chromosome_dir_path, block_type="single_block")
+    # # Note single maf blocks which failed twice
+    # with open(bad_maf_file_path, "a", encoding="UTF-8") as f_handle:
+    #     f_handle.write(
+    #         "\n".join(
+    #             [
+    #                 f"{genome_alignment_dir}big_blocks/{mb}.maf"
+    #                 for mb in failed_twice
+    #             ]
+    #         )
+    #         + "\n"
+    #     )
+    # failed_twice += find_failed_twice(chromosome_dir_path, block_type="big_block")
+    # # if len(failed_twice) != 0:
+    # #     print(f"The following blocks failed twice {', '.join(failed_twice)}")
+
+    rnacode_res = load_results(get_result_file_paths(chromosome_dir_path), P_THRESHOLD)
+
+    segments = build_segments(rnacode_res, chromosome)
+
+    hss_score_dic = {
+        seg["id"]: seg["p_val"]
+        for seg in segments
+    }
+
+    with open(hss_score_dic_path, "w", encoding="UTF-8") as f_handle:
+        json.dump(hss_score_dic, f_handle)
+
+    bed_lines = hss_to_bed_line(segments)
+
+    with open(bed_file_path, "w", encoding="UTF-8") as f_handle:
+        f_handle.write(
+            "\n".join([" ".join(map(str, line)) for line in bed_lines]) + "\n"
+        )
 
-        with open(hss_score_dic_path, "w", encoding="UTF-8") as f_handle:
-            json.dump(hss_score_dic, f_handle)
+    write_bed_manifest(manifest_path, manifest)
+    return True
 
-        print("Make bed lines")
-        bed_lines = hss_to_bed_line(segments)
 
-        with open(bed_file_path, "w", encoding="UTF-8") as f_handle:
-            f_handle.write(
-                "\n".join([" ".join(map(str, line)) for line in bed_lines]) + "\n"
-            )
+def bed_line_sort_key(line):
+    """Sort bed lines by chromosome, start, end, strand and name."""
+    line = line.split(" ")
+    return line[0], int(line[1]), int(line[2]), line[5], line[3]
 
-        with open(genome_bed_file_path, "a", encoding="UTF-8") as f_handle:
-            f_handle.write(
-                "\n".join([" ".join(map(str, line)) for line in bed_lines]) + "\n"
-            )
 
+def build_bed(genome_alignment_dir):
+    """Build bed file from RNAcode results.
 
-def hss_to_bed_line(segments):
-    """Convert a list of high scoring segments from RNAcode to a bed line."""
-    block_count = 1
-    block_starts = 0
-    exp_ids = 1
-    exp_count = 1
-
-    frame_color_dic = {}
-    # frame 1 red
-    frame_color_dic[1] = ["255,128,128", "255,26,26"]
-    # frame 2 blue
-    frame_color_dic[2] = ["128,128,255", "26,26,255"]
-    # frame 3 green
-    frame_color_dic[3] = ["153,230,153", "45,185,45"]
-    # frame 4 purple
-    frame_color_dic[4] = ["223,128,255", "172,0,230"]
-    # frame 5 orange
-    frame_color_dic[5] = ["255,191,128", "230,115,0"]
-    # frame 6 turquoise
-    frame_color_dic[6] = ["128,255,229", "0,230,184"]
-
-    lines = []
-    for segment in segments:
-        p_val = segment["p_val"] if segment["p_val"] > 0 else 0.000001
-        score = min(int(log(p_val, 2) * -1), 1000)
-        name = segment["id"]
-        thick_end = chrom_end = segment["end"] + 1
-        thick_start = chrom_start = segment["start"]
-        if segment["strand"] == "-1":
-            frame = chrom_start % 3 + 4
-        else:
-            frame = chrom_start % 3 + 1
-        quality = 0 if segment["p_val"] > 0.001 else 1
+    The chromosomes are processed in parallel, only those with changed
+    results are rebuilt. The genome wide bed file is merged from the bed
+    files of the chromosomes, sorted by coordinates and written to a
+    temporary file first, hence it is either complete or missing. The
+    p values of all chromosomes are written into one HssScoreStore.
+    """
+    print("Build bed file")
+    genome_bed_file_path = f"{genome_alignment_dir}/RNAcode.bed"
 
-        item_rgb = frame_color_dic[frame][quality]
-        block_sizes = chrom_end - chrom_start
-        lines.append(
-            [
-                segment["chromosome"],
-                chrom_start,
-                chrom_end,
-                name,
-                score,
-                segment["strand"],
-                thick_start,
-                thick_end,
-                item_rgb,
-                block_count,
-                block_sizes,
-                block_starts,
-                exp_count,
-                exp_ids,
-            ]
-        )
-    return lines
+    bad_maf_file_path = "./bad_maf_blocks.txt"
 
+    if os.path.isfile(bad_maf_file_path):
+        os.remove(bad_maf_file_path)
 
-def full_pipeline(work_dir, web_ftp):
+    chromosome_dir_paths = [
+        f"{genome_alignment_dir}/{chromosome}/"
+        for chromosome in sorted(os.listdir(genome_alignment_dir))
+        if os.path.isdir(genome_alignment_dir + "/" + chromosome)
+    ]
+
+    genome_bed_lines = []
+    hss_score_dic = {}
+    with Pool(NUM_CPUS) as pool:
+        for chromosome_dir_path, built in zip(
+            chromosome_dir_paths, pool.imap(build_bed_chromosome, chromosome_dir_paths)
+        ):
+            chromosome = os.path.basename(os.path.normpath(chromosome_dir_path))
+            print(f"Processed {chromosome}" if built else f"{chromosome} unchanged")
+            with open(f"{chromosome_dir_path}/RNAcode.bed", "r", encoding="UTF-8") as f_handle:
+                genome_bed_lines += [line for line in f_handle if line != "\n"]
+            with open(f"{chromosome_dir_path}/hss_score_dic.json", "r", encoding="UTF-8") as f_handle:
+                hss_score_dic.update(json.load(f_handle))
+
+    genome_bed_lines.sort(key=bed_line_sort_key)
+    with open(genome_bed_file_path + ".tmp", "w", encoding="UTF-8") as f_handle:
+        f_handle.writelines(genome_bed_lines)
+    os.replace(genome_bed_file_path + ".tmp", genome_bed_file_path)
+    HssScoreStore.write(f"{genome_alignment_dir}/{HSS_SCORE_STORE}", hss_score_dic)
+
+
+def full_pipeline(work_dir, web_ftp, verify=False):
     """Full Piepline."""
-    init_work_dir(work_dir, web_ftp)
+    init_work_dir(work_dir, web_ftp, verify)
     compute_genome_alignment_big_blocks(work_dir)
     check_failed_and_retry(work_dir)
     build_bed(work_dir)
 
 
 def main():
-    """Execute pipeline according to global parameters."""
-    full_pipeline(MULTIZ100WAY_DIR, MULTIZ100WAY_WEB_FTP)
-    full_pipeline(MULTIZ100WAY_DIR_OLD, MULTIZ100WAY_WEB_FTP)
+    """Execute pipeline according to global parameters.
+
+    With --verify the checksums of all maf files are computed again.
+    """
+    verify = "--verify" in sys.argv[1:]
+    full_pipeline(MULTIZ100WAY_DIR, MULTIZ100WAY_WEB_FTP, verify)
+    full_pipeline(MULTIZ100WAY_DIR_OLD, MULTIZ100WAY_WEB_FTP, verify)
 
 
 if __name__ == "__main__":
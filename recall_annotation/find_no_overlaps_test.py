@@ -3,9 +3,13 @@
 
 import json
 import os
+import sys
 from glob import glob
 import subprocess
 
+sys.path.append(os.path.join(os.path.dirname(os.path.abspath(__file__)), ".."))
+from HssScoreStore import HssScoreStore
+
 
 with open("../parameters_local.json", "r", encoding="UTF-8") as file_handle:
     parameters = json.load(file_handle)
@@ -18,14 +22,7 @@ false_anno_path = genome_alignment_dir + "/RNAcode_no_overlap.bed"
 # only the last part needs to be changed if a new UCSC session was used
 base_url = "https://genome-euro.ucsc.edu/cgi-bin/hgTracks?db=hg38&lastVirtModeType=default&lastVirtModeExtraState=&virtModeType=default&virtMode=0&nonVirtPosition=&position={}%3A{}%2D{}&hgsid=289764578_6cpu3ma1XGs6ShjdAiG0hltYiGwb"
 
-hss_score_dic = {}
-for chromosome in os.listdir(genome_alignment_dir):
-    if not os.path.isdir(genome_alignment_dir + "/" + chromosome):
-        continue
-    chromosome_dir_path = f"{genome_alignment_dir}/{chromosome}/"
-    hss_score_dic_path = f"{chromosome_dir_path}/hss_score_dic.json"
-    with open(hss_score_dic_path, "r", encoding="UTF-8") as f_handle:
-        hss_score_dic.update(json.load(f_handle))
+hss_score_dic = HssScoreStore(f"{genome_alignment_dir}/hss_scores")
 
 i = 0
 with open(false_anno_path, "r", encoding="UTF-8") as f_handle:
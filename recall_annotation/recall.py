@@ -13,6 +13,9 @@ import numpy as np
 
 from IntervalFrameTree import IntervalFrameTree
 
+sys.path.append(os.path.join(os.path.dirname(os.path.abspath(__file__)), ".."))
+from HssScoreStore import HssScoreStore
+
 
 with open("../parameters_local.json", "r", encoding="UTF-8") as file_handle:
     parameters = json.load(file_handle)
@@ -48,33 +51,30 @@ def gene_recall(genome_alignment_dir):
     gtf_ift = IntervalFrameTree(gtf_file_path=f"{DATA_DIR}/{ANNOTATION_FILE_MOD}", remove_non_coding=True)
     rnacode_ift = IntervalFrameTree(bed_file_path=f"{genome_alignment_dir}/RNAcode.bed")
 
-    hss_score_dic = {}
-    for chromosome in os.listdir(genome_alignment_dir):
-        if not os.path.isdir(genome_alignment_dir + "/" + chromosome):
-            continue
-        chromosome_dir_path = f"{genome_alignment_dir}/{chromosome}/"
-        hss_score_dic_path = f"{chromosome_dir_path}/hss_score_dic.json"
-        with open(hss_score_dic_path, "r", encoding="UTF-8") as f_handle:
-            hss_score_dic.update(json.load(f_handle))
+    hss_score_store = HssScoreStore(f"{genome_alignment_dir}/hss_scores")
 
     gene_hss_dic = rnacode_ift.overlap_by_gene(gtf_ift)
 
-    p_val_list = []
+    gene_hss_ids = []
     not_found_genes = []
     for gene_id, intervals in gene_hss_dic.items():
         if len(intervals) == 0:
             not_found_genes.append(gene_id)
             continue
+        # legacy
+        # hss_id = f"{hss[0]}_{hss[3]}"
+        gene_hss_ids.append([hss.split()[3] for hss in intervals])
+
+    hss_p_vals = hss_score_store.get_many(
+        [hss_id for hss_ids in gene_hss_ids for hss_id in hss_ids]
+    )
+    p_val_list = []
+    i = 0
+    for hss_ids in gene_hss_ids:
         # This is the cut off from RNAcode
-        best_p = 0.01
-        for hss in intervals:
-            hss = hss.split()
-            hss_id = hss[3]
-            # legacy
-            # hss_id = f"{hss[0]}_{hss[3]}"
-
-            best_p = min(hss_score_dic[hss_id], best_p)
-        p_val_list.append(best_p)
+        best_p = min(0.01, hss_p_vals[i:i + len(hss_ids)].min())
+        p_val_list.append(float(best_p))
+        i += len(hss_ids)
 
     p_val_list.sort()
 
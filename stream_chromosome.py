@@ -1,7 +1,31 @@
 #!/usr/bin/python3
-"""Get answer of Life, the Universe and Everything."""
+"""Get answer of Life, the Universe and Everything.
 
-from MafBlock import MafStream
+Usage: stream_chromosome.py [--force] <maf file> [number of processes] [cost per big block]
+
+A chromosome that was already preprocessed is skipped, unless --force is
+given or one of its files changed, see PipelineJournal.
+
+Big blocks are filled up to an estimated RNAcode cost, see maf_cost(). A cost
+of 0 cuts a big block every BB_SIZE maf blocks instead. The estimated cost of
+every big block is written to big_block_costs.json in the chromosome dir.
+
+With more than one process the chromosome is cut into shards at target
+breaks (see MafStream.is_target_break), the shards are preprocessed on a
+process pool and stitched together. The big blocks and block_dic.json are
+byte identical to a run with one process.
+
+preprocess_chromosome() reports every big block as soon as it is complete,
+RNAcodeScheduler.iterate_preprocessed() uses this to run RNAcode while the
+chromosomes are still preprocessed. With in_memory the big blocks are not
+written at all but handed over as bytes.
+"""
+
+from MafBlock import MafStream, split_raw_blocks
+from PipelineJournal import finish_stage, stage_done, start_stage
+from bisect import bisect_left
+from multiprocessing import Pool
+import io
 import sys
 import os
 import json
@@ -21,30 +45,18 @@ MAX_DEL_SPECIES = 1
 # Parameter for splitting
 MAX_LEN_NO_SPLIT = 3000
 
-# Big block size
+# Big block size, if big blocks are not packed by cost
 BB_SIZE = 1000
+# Estimated RNAcode cost of a big block, see maf_cost()
+BB_COST = 10_000_000
 
+# Shards per process, more shards balance the load better.
+SHARDS_PER_PROCESS = 4
 
-def main():
-    """Get answer of Life, the Universe and Everything."""
-    maf_file_path = sys.argv[1]
-    if not os.path.isfile(maf_file_path):
-        print(f"Maf file {maf_file_path} does not exist!")
-        sys.exit(1)
-
-    chromosome_dir = os.path.dirname(maf_file_path)
-    chromosome_name = os.path.basename(maf_file_path).split(".")[0]
-
-    split_dir = os.path.join(os.path.split(maf_file_path)[0], "big_blocks")
-    if not os.path.isdir(split_dir):
-        os.mkdir(split_dir)
-    else:
-        for block_file in os.listdir(split_dir):
-            if not os.path.isfile(os.path.join(split_dir, block_file)):
-                continue
-            os.remove(os.path.join(split_dir, block_file))
 
-    maf_stream = MafStream(
+def get_maf_stream(maf_file_path):
+    """Get maf stream with the preprocessing parameters."""
+    return MafStream(
         path=maf_file_path,
         min_length_del=MIN_LENGTH_DEL,
         max_del_species=MAX_DEL_SPECIES,
@@ -53,26 +65,293 @@ def main():
         max_len_no_split=MAX_LEN_NO_SPLIT,
     )
 
-    bb_num = 1
-    maf_counter = 0
+
+def maf_cost(maf):
+    """Estimate the RNAcode runtime of a maf block, columns times sequences."""
+    return len(maf) * maf.size()
+
+
+class BigBlockPacker:
+    """Number the maf blocks written into big blocks.
+
+    With max_cost a big block is filled until the next maf block would exceed
+    the cost, otherwise a new big block is started every BB_SIZE blocks.
+    """
+
+    def __init__(self, chromosome_name, max_cost=0):
+        """Init packer.
+
+        :param str chromosome_name: Prefix of the small target names.
+        :param int max_cost: Estimated cost of a big block, 0 to pack by
+            BB_SIZE.
+        """
+        self.chromosome_name = chromosome_name
+        self.max_cost = max_cost
+        self.bb_num = 1
+        self.maf_counter = 0
+        self.costs = {}
+
+    def add(self, cost):
+        """Add a maf block.
+
+        :param int cost: Estimated cost of the maf block.
+        :return: Big block number and small target name of the maf block.
+        :rtype: tuple
+        """
+        if self.max_cost:
+            bb_cost = self.costs.get(self.bb_num, 0)
+            if bb_cost > 0 and bb_cost + cost > self.max_cost:
+                self.bb_num += 1
+                self.maf_counter = 0
+            self.maf_counter += 1
+        else:
+            self.maf_counter += 1
+            if self.maf_counter > BB_SIZE:
+                self.bb_num += 1
+                self.maf_counter = 0
+        self.costs[self.bb_num] = self.costs.get(self.bb_num, 0) + cost
+        return self.bb_num, f"{self.chromosome_name}_{self.maf_counter}_{self.bb_num}"
+
+    def cost_manifest(self):
+        """Get estimated cost of each big block."""
+        return {f"big_block_{bb_num}": cost for bb_num, cost in self.costs.items()}
+
+
+def find_shards(maf_stream, num_shards):
+    """Cut maf file into shards of similar size at target breaks.
+
+    :return: Block index and offset of the first block of each shard.
+    :rtype: list
+    """
+    breaks = list(maf_stream.target_breaks())
+    if not breaks:
+        return [(0, 0)]
+    break_off_sets = [off_set for _block_index, off_set in breaks]
+    shard_size = break_off_sets[-1] / num_shards
+    shard_starts = [breaks[0]]
+    for shard in range(1, num_shards):
+        i = bisect_left(break_off_sets, shard * shard_size)
+        if i < len(breaks) and breaks[i][0] > shard_starts[-1][0]:
+            shard_starts.append(breaks[i])
+    return shard_starts
+
+
+def preprocess_shard(shard):
+    """Preprocess one shard and write the maf blocks into a temporary file.
+
+    :param tuple shard: Maf file path, shard start, first block index of the
+        next shard and path of the temporary file.
+    :return: The block index list and the cost of each written maf block.
+    :rtype: list
+    """
+    maf_file_path, start, stop_block_index, shard_file_path = shard
+    maf_stream = get_maf_stream(maf_file_path)
+    block_infos = []
+    with open(shard_file_path, "w", encoding="UTF-8") as f_handle:
+        for maf in maf_stream.discard_stream(
+            blocks=maf_stream.iterate_shard(start, stop_block_index)
+        ):
+            block_infos.append((maf.block_index_list, maf_cost(maf)))
+            f_handle.write(str(maf))
+    return block_infos
+
+
+def rename_raw_target(raw_block, name):
+    """Replace the target name of a raw maf block written by str(MafBlock).
+
+    The block may start with the a line or directly with the target line,
+    like in raw_block_coordinates() of MafBlock.
+    """
+    if raw_block.startswith(b"s "):
+        name_start = len(b"s ")
+    else:
+        name_start = raw_block.index(b"\ns ") + len(b"\ns ")
+    name_end = raw_block.index(b" ", name_start)
+    return raw_block[:name_start] + name + raw_block[name_end:]
+
+
+class BigBlockWriter:
+    """Write maf blocks into the big block files, or keep them in memory.
+
+    A big block is complete once the first maf block of the next one is
+    written, or the writer is closed.
+    """
+
+    def __init__(self, split_dir, on_big_block=None, in_memory=False):
+        """Init writer and open the first big block.
+
+        :param on_big_block: Called with the path of each complete big block
+            and its content, the content is None if it was written to disk.
+        :param bool in_memory: Keep the big blocks in memory, nothing is
+            written to split_dir then.
+        """
+        self.split_dir = split_dir
+        self.on_big_block = on_big_block
+        self.in_memory = in_memory
+        self.bb_num = None
+        self.f_handle = None
+        self._open(1)
+
+    def get_path(self):
+        """Get path of the current big block."""
+        return os.path.join(self.split_dir, f"big_block_{self.bb_num}.maf")
+
+    def _open(self, bb_num):
+        self.bb_num = bb_num
+        self.f_handle = io.BytesIO() if self.in_memory else open(self.get_path(), "wb")
+
+    def write(self, bb_num, raw_block):
+        """Write raw maf block into big block bb_num."""
+        if bb_num != self.bb_num:
+            self.close()
+            self._open(bb_num)
+        self.f_handle.write(raw_block)
+
+    def close(self):
+        """Close the current big block."""
+        if self.f_handle is None:
+            return
+        maf_content = self.f_handle.getvalue() if self.in_memory else None
+        self.f_handle.close()
+        self.f_handle = None
+        if self.on_big_block is not None:
+            self.on_big_block(self.get_path(), maf_content)
+
+
+def write_big_blocks_serial(maf_stream, packer, writer):
+    """Preprocess the maf file and write the big blocks."""
     block_dic = {}
-    f_handle = open(os.path.join(split_dir, f"big_block_{bb_num}.maf"), "w", encoding="UTF-8")
     for maf in maf_stream.discard_stream():
-        maf_counter += 1
-        if maf_counter > BB_SIZE:
-            bb_num += 1
-            maf_counter = 0
-            f_handle.close()
-            f_handle = open(os.path.join(split_dir, f"big_block_{bb_num}.maf"), "w", encoding="UTF-8")
-        small_target_name = f"{chromosome_name}_{maf_counter}_{bb_num}"
+        bb_num, small_target_name = packer.add(maf_cost(maf))
         block_dic[small_target_name] = maf.block_index_list
-        maf.block[1][1] = small_target_name
+        maf.set_target(small_target_name)
+
+        writer.write(bb_num, str(maf).encode("UTF-8"))
+
+    writer.close()
+    return block_dic
+
+
+def write_big_blocks_parallel(maf_stream, packer, writer, num_processes):
+    """Preprocess the maf file in shards on a process pool and write the big blocks.
+
+    The shards are stitched in order, hence the big blocks are the same as
+    from write_big_blocks_serial().
+    """
+    shard_starts = find_shards(maf_stream, num_processes * SHARDS_PER_PROCESS)
+    stop_block_indices = [start[0] for start in shard_starts[1:]] + [None]
+    shards = [
+        (maf_stream.path, start, stop, os.path.join(writer.split_dir, f"shard_{i}.maf.tmp"))
+        for i, (start, stop) in enumerate(zip(shard_starts, stop_block_indices))
+    ]
+
+    block_dic = {}
+    with Pool(num_processes) as pool:
+        for shard, block_infos in zip(
+            shards, pool.imap(preprocess_shard, shards)
+        ):
+            shard_file_path = shard[-1]
+            with open(shard_file_path, "rb") as shard_handle:
+                for (block_index_list, cost), (_block_index, _off_set, raw_block) in zip(
+                    block_infos, split_raw_blocks(shard_handle)
+                ):
+                    bb_num, small_target_name = packer.add(cost)
+                    block_dic[small_target_name] = block_index_list
+                    writer.write(
+                        bb_num,
+                        rename_raw_target(raw_block, small_target_name.encode("ascii"))
+                        + b"\n",
+                    )
+            os.remove(shard_file_path)
+
+    writer.close()
+    return block_dic
+
+
+def preprocess_chromosome(
+    maf_file_path,
+    num_processes=1,
+    max_cost=BB_COST,
+    force=False,
+    on_big_block=None,
+    in_memory=False,
+):
+    """Preprocess the maf file of a chromosome into big blocks.
+
+    :param bool force: Preprocess even if it was done already.
+    :param on_big_block: Called with the path and content of each big block
+        once it is complete, see BigBlockWriter. For a chromosome that was
+        already preprocessed it is called for every existing big block.
+    :param bool in_memory: Pass the big blocks to on_big_block instead of
+        writing them. The chromosome is always preprocessed then and the
+        stage is not journaled, as there are no files to resume from. The
+        files in big_blocks are kept, the RNAcode results and the big blocks
+        written for the single block retry are resumed from.
+    """
+    chromosome_dir = os.path.dirname(maf_file_path)
+    chromosome_name = os.path.basename(maf_file_path).split(".")[0]
+    split_dir = os.path.join(os.path.split(maf_file_path)[0], "big_blocks")
+
+    if not force and not in_memory and stage_done(chromosome_dir, "preprocess"):
+        print(f"{chromosome_name} already preprocessed")
+        if on_big_block is not None:
+            with open(
+                os.path.join(chromosome_dir, "big_block_costs.json"), "r", encoding="UTF-8"
+            ) as f_handle:
+                for big_block in json.load(f_handle):
+                    on_big_block(os.path.join(split_dir, f"{big_block}.maf"), None)
+        return
+    if not in_memory:
+        start_stage(chromosome_dir, "preprocess")
+
+    if not os.path.isdir(split_dir):
+        os.mkdir(split_dir)
+    elif not in_memory:
+        for block_file in os.listdir(split_dir):
+            if not os.path.isfile(os.path.join(split_dir, block_file)):
+                continue
+            os.remove(os.path.join(split_dir, block_file))
+
+    maf_stream = get_maf_stream(maf_file_path)
+    packer = BigBlockPacker(chromosome_name, max_cost)
+    writer = BigBlockWriter(split_dir, on_big_block, in_memory)
 
-        f_handle.write(str(maf))
+    if num_processes > 1:
+        block_dic = write_big_blocks_parallel(maf_stream, packer, writer, num_processes)
+    else:
+        block_dic = write_big_blocks_serial(maf_stream, packer, writer)
 
-    f_handle.close()
     with open(os.path.join(chromosome_dir, "block_dic.json"), "w", encoding="UTF-8") as f_handle:
         json.dump(block_dic, f_handle)
+    with open(os.path.join(chromosome_dir, "big_block_costs.json"), "w", encoding="UTF-8") as f_handle:
+        json.dump(packer.cost_manifest(), f_handle)
+
+    if in_memory:
+        return
+    finish_stage(
+        chromosome_dir,
+        "preprocess",
+        [
+            maf_file_path,
+            os.path.join(chromosome_dir, "block_dic.json"),
+            os.path.join(chromosome_dir, "big_block_costs.json"),
+        ]
+        + [os.path.join(split_dir, f"{big_block}.maf") for big_block in packer.cost_manifest()],
+    )
+
+
+def main():
+    """Get answer of Life, the Universe and Everything."""
+    force = "--force" in sys.argv[1:]
+    arguments = [argument for argument in sys.argv[1:] if argument != "--force"]
+    maf_file_path = arguments[0]
+    if not os.path.isfile(maf_file_path):
+        print(f"Maf file {maf_file_path} does not exist!")
+        sys.exit(1)
+    num_processes = int(arguments[1]) if len(arguments) > 1 else 1
+    max_cost = int(arguments[2]) if len(arguments) > 2 else BB_COST
+
+    preprocess_chromosome(maf_file_path, num_processes, max_cost, force)
 
 
 if __name__ == "__main__":
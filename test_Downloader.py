@@ -0,0 +1,137 @@
+#!/usr/bin/python3
+"""Test Downloader against a local HTTP server."""
+
+import hashlib
+import os
+import tempfile
+import threading
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+import Downloader
+
+Downloader.RETRY_WAIT = 0
+
+FILES = {f"/chr{i}.maf.gz": os.urandom(3 * Downloader.CHUNK_SIZE + 1000 * i) for i in range(1, 5)}
+# Error status of paths that are not served
+ERRORS = {"/chrZ.maf.gz": 404, "/chrY.maf.gz": 403, "/chrX.maf.gz": 503, "/chrW.maf.gz": 429}
+
+
+class RangeHandler(BaseHTTPRequestHandler):
+    """Serve FILES with range requests, the first response of a file breaks off."""
+
+    broken = set()
+    ranges = []
+    requests = []
+
+    def do_GET(self):
+        """Send file from the requested offset."""
+        RangeHandler.requests.append(self.path)
+        if self.path not in FILES:
+            self.send_error(ERRORS.get(self.path, 404))
+            return
+        data = FILES[self.path]
+        off_set = 0
+        if "Range" in self.headers:
+            off_set = int(self.headers["Range"].split("=")[1].split("-")[0])
+        RangeHandler.ranges.append((self.path, off_set))
+        if off_set >= len(data):
+            self.send_error(416)
+            return
+        self.send_response(206 if off_set else 200)
+        self.send_header("Content-Length", str(len(data) - off_set))
+        self.end_headers()
+        if self.path not in RangeHandler.broken:
+            RangeHandler.broken.add(self.path)
+            self.wfile.write(data[off_set:off_set + len(data) // 2])
+            self.wfile.flush()
+            self.connection.close()
+            return
+        self.wfile.write(data[off_set:])
+
+    def log_message(self, *args):
+        """Keep quiet."""
+
+
+def serve():
+    """Start server in a thread."""
+    server = ThreadingHTTPServer(("127.0.0.1", 0), RangeHandler)
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    return server, f"http://127.0.0.1:{server.server_address[1]}"
+
+
+def test_download_files_resume():
+    """Downloads break off once and are resumed."""
+    RangeHandler.broken = set()
+    RangeHandler.ranges = []
+    server, url = serve()
+    with tempfile.TemporaryDirectory() as tmp_dir:
+        downloads = [
+            (url + path, tmp_dir + path, hashlib.md5(data).hexdigest())
+            for path, data in FILES.items()
+        ]
+        assert Downloader.download_files(downloads, num_downloads=2) == {}
+        for path, data in FILES.items():
+            with open(tmp_dir + path, "rb") as f_handle:
+                assert f_handle.read() == data
+            assert not os.path.isfile(tmp_dir + path + ".part")
+            assert Downloader.file_md5(tmp_dir + path) == hashlib.md5(data).hexdigest()
+    server.shutdown()
+    # Every file was resumed, not downloaded again
+    assert sorted(off_set > 0 for _path, off_set in RangeHandler.ranges) == [False] * 4 + [True] * 4
+
+
+def test_download_file_part_complete():
+    """A complete part file is only checked."""
+    RangeHandler.broken = set(FILES)
+    server, url = serve()
+    data = FILES["/chr1.maf.gz"]
+    with tempfile.TemporaryDirectory() as tmp_dir:
+        with open(tmp_dir + "/chr1.maf.gz.part", "wb") as f_handle:
+            f_handle.write(data)
+        checksum = Downloader.download_file(url + "/chr1.maf.gz", tmp_dir + "/chr1.maf.gz")
+        assert checksum == hashlib.md5(data).hexdigest()
+    server.shutdown()
+
+
+def test_download_file_corrupt():
+    """A wrong checksum raises ValueError and removes the part file."""
+    RangeHandler.broken = set(FILES)
+    server, url = serve()
+    with tempfile.TemporaryDirectory() as tmp_dir:
+        try:
+            Downloader.download_file(url + "/chr2.maf.gz", tmp_dir + "/chr2.maf.gz", "0" * 32)
+        except ValueError:
+            pass
+        else:
+            raise AssertionError("Corrupt download not detected")
+        assert os.listdir(tmp_dir) == []
+    server.shutdown()
+
+
+def test_download_file_missing():
+    """Client errors fail at once, timeouts, rate limits and server errors after all tries."""
+    RangeHandler.requests = []
+    server, url = serve()
+    with tempfile.TemporaryDirectory() as tmp_dir:
+        downloads = [(url + path, tmp_dir + path, None) for path in ERRORS]
+        failed = Downloader.download_files(downloads)
+        assert sorted(failed) == sorted(tmp_dir + path for path in ERRORS)
+        assert all(isinstance(error, ConnectionError) for error in failed.values())
+        assert os.listdir(tmp_dir) == []
+    server.shutdown()
+    for path, code in ERRORS.items():
+        tries = 1 if code in (403, 404) else Downloader.MAX_TRIES
+        assert RangeHandler.requests.count(path) == tries
+
+
+def main():
+    """Test Downloader."""
+    test_download_files_resume()
+    test_download_file_part_complete()
+    test_download_file_corrupt()
+    test_download_file_missing()
+    print("Downloader OK")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,99 @@
+#!/usr/bin/python3
+"""Test HssScoreStore against the dictionary it is written from."""
+
+import os
+import random
+import tempfile
+
+import numpy as np
+
+import HssScoreStore
+from HssScoreStore import HssScoreStore as Store
+
+
+def random_hss_score_dic(rng, num_ids):
+    """Get random HSS ids with p values."""
+    return {
+        f"chr{rng.randrange(1, 23)}_{start}_{start + rng.randrange(10, 300)}_{i}": rng.random()
+        for i, start in enumerate(rng.randrange(10**8) for _ in range(num_ids))
+    }
+
+
+def test_round_trip():
+    """A written store gives the p value of every id through the mapped files."""
+    rng = random.Random(19)
+    hss_score_dic = random_hss_score_dic(rng, 2000)
+    with tempfile.TemporaryDirectory() as tmp_dir:
+        store_path = os.path.join(tmp_dir, "hss_scores")
+        Store.write(store_path, hss_score_dic)
+        # Writing again replaces the store
+        Store.write(store_path, hss_score_dic)
+        assert sorted(os.listdir(tmp_dir)) == ["hss_scores"]
+        store = Store(store_path)
+        assert isinstance(store.hashes, np.memmap)
+        assert len(store) == len(hss_score_dic)
+        hss_ids = rng.sample(list(hss_score_dic), 500)
+        assert [store[hss_id] for hss_id in hss_ids] == [hss_score_dic[i] for i in hss_ids]
+        assert store.get_many(hss_ids).tolist() == [hss_score_dic[i] for i in hss_ids]
+        assert all(hss_id in store for hss_id in hss_ids)
+
+
+def test_missing_and_empty():
+    """A missing id raises KeyError, no ids give an empty array."""
+    with tempfile.TemporaryDirectory() as tmp_dir:
+        store_path = os.path.join(tmp_dir, "hss_scores")
+        Store.write(store_path, {"chr1_1_20": 0.5, "chr1_30_90": 0.01})
+        store = Store(store_path)
+        assert "chr2_1_20" not in store
+        for lookup in (
+            lambda: store["chr2_1_20"],
+            lambda: store.get_many(["chr1_1_20", "chr2_1_20"]),
+        ):
+            try:
+                lookup()
+            except KeyError:
+                continue
+            raise AssertionError("Missing id not detected")
+        assert store.get_many([]).tolist() == []
+
+        Store.write(store_path, {})
+        store = Store(store_path)
+        assert len(store) == 0 and store.get_many([]).tolist() == []
+        assert "chr1_1_20" not in store
+
+
+def test_hash_collisions():
+    """Ids with the same hash are told apart by the stored ids."""
+    hash_hss_id = HssScoreStore.hash_hss_id
+    rng = random.Random(23)
+    hss_score_dic = random_hss_score_dic(rng, 300)
+    try:
+        HssScoreStore.hash_hss_id = lambda hss_id: hash_hss_id(hss_id) % 5
+        with tempfile.TemporaryDirectory() as tmp_dir:
+            store_path = os.path.join(tmp_dir, "hss_scores")
+            Store.write(store_path, hss_score_dic)
+            store = Store(store_path)
+            hss_ids = list(hss_score_dic)
+            rng.shuffle(hss_ids)
+            assert store.get_many(hss_ids).tolist() == [hss_score_dic[i] for i in hss_ids]
+            assert [store[hss_id] for hss_id in hss_ids] == [hss_score_dic[i] for i in hss_ids]
+            try:
+                store.get_many(hss_ids[:3] + ["chr1_1_2_missing"])
+            except KeyError:
+                pass
+            else:
+                raise AssertionError("Missing id not detected")
+    finally:
+        HssScoreStore.hash_hss_id = hash_hss_id
+
+
+def main():
+    """Test HssScoreStore."""
+    test_round_trip()
+    test_missing_and_empty()
+    test_hash_collisions()
+    print("HssScoreStore OK")
+
+
+if __name__ == "__main__":
+    main()
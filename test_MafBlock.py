@@ -0,0 +1,150 @@
+#!/usr/bin/python3
+"""Test MafBlock against line based reference implementations."""
+
+import os
+import random
+import re
+import tempfile
+
+from AlignmentHtml import conservation_line
+from MafBlock import MafBlock, write_html
+
+
+def random_maf_lines(rng, num_rows, length):
+    """Get s lines of a random block, some rows mostly gaps or N."""
+    lines = []
+    for row in range(num_rows):
+        alphabet = rng.choice(["ACGT-", "ACGTN-", "N-", "-------A", "nnnnA-"])
+        sequence = "".join(rng.choice(alphabet) for _ in range(length))
+        if row == 0:
+            sequence = rng.choice("ACGT") + sequence[1:].replace("N", "A")
+            sequence = "-" * rng.randrange(5) + sequence + "-" * rng.randrange(5)
+        else:
+            sequence = sequence.ljust(len(lines[0].split()[6]), "-")
+        size = len(sequence) - sequence.count("-")
+        lines.append(f"s species{row}.chr1 {rng.randrange(10**6)} {size} + 10000000 {sequence}")
+    return lines
+
+
+def clean_reference(lines):
+    """Clean s lines like MafBlock.clean() with regular expressions."""
+    rows = [line.split() for line in lines]
+    target = rows[0][6]
+    leading = re.match("-*", target).end()
+    trailing = len(target) - len(target.rstrip("-"))
+    cleaned = []
+    for i, row in enumerate(rows):
+        row[6] = row[6][leading:len(row[6]) - trailing]
+        undefined = len(re.findall("[Nn-]", row[6])) / len(row[6]) * 100
+        if i == 0 or undefined < 95:
+            cleaned.append(" ".join(row))
+    return cleaned
+
+
+def test_clean():
+    """clean() trims target gaps and removes undefined rows like the reference."""
+    rng = random.Random(11)
+    for _ in range(300):
+        lines = random_maf_lines(rng, rng.randrange(1, 8), rng.randrange(1, 60))
+        maf = MafBlock("\n".join(["a score=0"] + lines))
+        maf.clean()
+        expected = MafBlock("\n".join(["a score=0"] + clean_reference(lines)))
+        assert str(maf) == str(expected)
+
+
+def add_symbols_reference(lines, symbol, positions):
+    """Add symbol at positions one after the other to s lines."""
+    rows = [line.split() for line in lines]
+    for row in rows:
+        for position in positions:
+            row[6] = row[6][:position] + symbol + row[6][position:]
+    return [" ".join(row) for row in rows]
+
+
+def test_add_symbols():
+    """add_symbols() gives the same as inserting into every line one by one."""
+    rng = random.Random(13)
+    for _ in range(300):
+        lines = random_maf_lines(rng, rng.randrange(1, 5), rng.randrange(1, 40))
+        length = len(lines[0].split()[6])
+        symbol = rng.choice(["|", "XY", "***"])
+        positions = [rng.randrange(length + 1) for _ in range(rng.randrange(6))]
+        if rng.random() < 0.7:
+            # Sorted positions of the growing alignment, inserted in one pass
+            positions = [
+                position + i * len(symbol) for i, position in enumerate(sorted(positions))
+            ]
+        maf = MafBlock("\n".join(["a score=0"] + lines))
+        maf.add_symbols(symbol, positions)
+        expected = add_symbols_reference(lines, symbol, positions)
+        assert str(maf) == str(MafBlock("\n".join(["a score=0"] + expected)))
+
+    # Positions out of range and descending positions are clamped like slices
+    lines = ["s hg38.chr1 10 4 + 100 AC-GT", "s mm10.chr1 5 5 + 100 ACNGT"]
+    for positions in ([9], [7, 1], [3, -1, 20], [-9, 2], [2, 9, 9]):
+        maf = MafBlock("\n".join(["a score=0"] + lines))
+        maf.add_symbols("|", positions)
+        expected = add_symbols_reference(lines, "|", positions)
+        assert str(maf) == str(MafBlock("\n".join(["a score=0"] + expected)))
+
+
+def test_insert_symbols():
+    """insert_symbols() takes positions of the alignment before insertion."""
+    maf = MafBlock("a score=0\ns hg38.chr1 10 4 + 100 AC-GT\ns mm10.chr1 5 5 + 100 ACNGT")
+    maf.insert_symbols("|", [0, 2, 2, 5])
+    assert maf.get_line_of_species("hg38.chr1")[6] == "|AC||-GT|"
+    assert maf.get_line_of_species("mm10.chr1")[6] == "|AC||NGT|"
+    for positions in ([2, 1], [10], [-1]):
+        try:
+            maf.insert_symbols("|", positions)
+        except ValueError:
+            continue
+        raise AssertionError(f"Positions {positions} not rejected")
+
+
+def test_html():
+    """Blocks are rendered in process, coloured and with conservation line."""
+    assert conservation_line(["ACGTA-", "ACGCA-", "ACTTAA"]) == "**  * "
+    assert conservation_line(["SG", "AA"]) == ":."
+    maf = MafBlock("a score=0\ns hg38.chr1 10 4 + 100 AC-GT\ns mm10.chr1 5 4 + 100 ACNGT")
+    html = maf.to_html("block <1>")
+    assert "<h3>block &lt;1&gt;</h3>" in html
+    assert "hg38.chr1_10:14" in html and "mm10.chr1_5:9" in html
+    assert '<span style="color:#80a0f0">AC</span>-<span style="color:#f09048">G</span>' in html
+    # The rows are rendered sorted by species, the block keeps its order
+    maf = MafBlock(
+        "a score=0\ns hg38.chr1 10 4 + 100 AC-GT\ns rn6.chr2 5 4 + 100 ACNGT\n"
+        "s mm10.chr1 5 4 + 100 ACNGT"
+    )
+    before = str(maf)
+    html = maf.to_html()
+    assert html.index("hg38.chr1") < html.index("mm10.chr1") < html.index("rn6.chr2")
+    assert str(maf) == before
+    with tempfile.TemporaryDirectory() as tmp_dir:
+        maf.generate_html(tmp_dir, name="blocks")
+        maf.generate_html(tmp_dir, name="blocks")
+        with open(os.path.join(tmp_dir, "blocks.html"), encoding="UTF-8") as f_handle:
+            assert f_handle.read() == 2 * maf.to_html()
+        html_file_path = os.path.join(tmp_dir, "batch.html")
+        write_html([maf, MafBlock("")], html_file_path, ["one", "two"])
+        with open(html_file_path, encoding="UTF-8") as f_handle:
+            document = f_handle.read()
+        assert document.startswith("<!DOCTYPE html>") and document.endswith("</html>\n")
+        assert "<h3>one</h3>" in document and "Empty Maf Block" in document
+        # An empty block without name goes to None.html, as before
+        MafBlock().generate_html(tmp_dir)
+        with open(os.path.join(tmp_dir, "None.html"), encoding="UTF-8") as f_handle:
+            assert f_handle.read() == "<p>Empty Maf Block</p><br>"
+
+
+def main():
+    """Test MafBlock."""
+    test_clean()
+    test_add_symbols()
+    test_insert_symbols()
+    test_html()
+    print("MafBlock OK")
+
+
+if __name__ == "__main__":
+    main()
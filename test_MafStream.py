@@ -0,0 +1,146 @@
+#!/usr/bin/python3
+"""Test MafStream.concat_blocks against the recursive concat_blocks_recursive."""
+
+import os
+import random
+import tempfile
+
+import MafBlock
+from MafBlock import MafStream
+
+SPECIES = ["panTro4", "gorGor3", "ponAbe2", "rheMac3", "calJac3"]
+
+
+def random_maf_file(rng, file_path, num_blocks):
+    """Write random maf blocks, many short and with few impeding species."""
+    positions = {species: rng.randrange(10**6) for species in ["hg38"] + SPECIES}
+    with open(file_path, "w", encoding="UTF-8") as f_handle:
+        f_handle.write("##maf version=1\n\n")
+        for _ in range(num_blocks):
+            length = rng.choice([rng.randrange(1, 20), rng.randrange(20, 120)])
+            if rng.random() < 0.03:
+                # Long enough to be split after the concatenation
+                length = rng.randrange(1000, 3500)
+            rows = ["hg38"] + [species for species in SPECIES if rng.random() < 0.7]
+            f_handle.write("a score=0.0\n")
+            for species in rows:
+                jump = rng.random()
+                if jump < 0.05:
+                    positions[species] += rng.randrange(20, 100)
+                elif jump < 0.1 and species == "hg38":
+                    # Target not adjacent to the block before
+                    positions[species] += rng.randrange(13, 40)
+                elif jump < 0.3:
+                    positions[species] += rng.randrange(1, 12)
+                sequence = "".join(rng.choice("ACGT-") for _ in range(length))
+                sequence = rng.choice("ACGT") + sequence[1:]
+                size = len(sequence) - sequence.count("-")
+                f_handle.write(
+                    f"s {species}.chr1 {positions[species]} {size} + 248956422 {sequence}\n"
+                )
+                positions[species] += size
+            f_handle.write("\n")
+
+
+def assert_aligned(mafs):
+    """All rows of every block have the same length."""
+    for maf in mafs:
+        lengths = {len(line.split()[6]) for line in str(maf).splitlines() if line.startswith("s ")}
+        assert len(lengths) <= 1, lengths
+
+
+def get_maf_stream(file_path):
+    """Get maf stream with the preprocessing parameters."""
+    return MafStream(
+        path=file_path,
+        min_length_del=60,
+        max_del_species=1,
+        min_size=3,
+        min_length=12,
+        max_len_no_split=3000,
+    )
+
+
+def test_concat_blocks():
+    """The single pass gives the same blocks as the recursion."""
+    rng = random.Random(3)
+    with tempfile.TemporaryDirectory() as tmp_dir:
+        file_path = os.path.join(tmp_dir, "chr1.maf")
+        for _ in range(20):
+            random_maf_file(rng, file_path, 200)
+            expected_end, expected = get_maf_stream(file_path).concat_blocks_recursive(
+                0, only_block=False, split=True
+            )
+            end, result = get_maf_stream(file_path).concat_blocks(0, only_block=False, split=True)
+            # The header of the file is block 0
+            assert end == expected_end == 200
+            assert [str(maf) for maf in result] == [str(maf) for maf in expected]
+            assert_aligned(result)
+
+            for block_index in rng.sample(range(201), 10):
+                expected_end, expected_maf = get_maf_stream(file_path).concat_blocks_recursive(
+                    block_index
+                )
+                end, maf = get_maf_stream(file_path).concat_blocks(block_index)
+                assert (end, str(maf)) == (expected_end, str(expected_maf))
+                assert_aligned([maf])
+
+
+def test_concat_blocks_bounded():
+    """Small look ahead window and cache give the same blocks."""
+    rng = random.Random(5)
+    lookahead_size, memo_size = MafBlock.LOOKAHEAD_SIZE, MafBlock.MEMO_SIZE
+    with tempfile.TemporaryDirectory() as tmp_dir:
+        file_path = os.path.join(tmp_dir, "chr1.maf")
+        random_maf_file(rng, file_path, 300)
+        _end, expected = get_maf_stream(file_path).concat_blocks_recursive(0, only_block=False)
+        try:
+            MafBlock.LOOKAHEAD_SIZE, MafBlock.MEMO_SIZE = 2, 1
+            _end, result = get_maf_stream(file_path).concat_blocks(0, only_block=False)
+        finally:
+            MafBlock.LOOKAHEAD_SIZE, MafBlock.MEMO_SIZE = lookahead_size, memo_size
+        assert [str(maf) for maf in result] == [str(maf) for maf in expected]
+
+
+def test_iterate_from_use_offset():
+    """Jumps to sparse checkpoints give the same blocks as iterate_from."""
+    rng = random.Random(7)
+    with tempfile.TemporaryDirectory() as tmp_dir:
+        file_path = os.path.join(tmp_dir, "chr1.maf")
+        random_maf_file(rng, file_path, 300)
+        maf_stream = get_maf_stream(file_path)
+        maf_stream.off_set_dic = MafBlock.OffsetCheckpoints(spacing=10_000)
+        for block_index in rng.sample(range(301), 30):
+            expected = [str(maf) for maf in get_maf_stream(file_path).iterate_from(block_index)]
+            assert [str(maf) for maf in maf_stream.iterate_from_use_offset(block_index)] == expected
+        stats = maf_stream.off_set_dic.stats()
+        assert 1 < stats["entries"] < 300
+        assert stats["hits"] == 29 and stats["misses"] == 1
+
+
+def test_lru_cache():
+    """Items are dropped when the cache is over its size in bytes."""
+    cache = MafBlock.LruCache(10, max_bytes=100, sizeof=len)
+    cache["a"] = "x" * 60
+    cache["b"] = "x" * 30
+    assert cache.get("a") is not None
+    cache["c"] = "x" * 30
+    assert list(cache) == ["a", "c"] and cache.num_bytes == 90
+    assert cache.get("b") is None
+    cache.pop("a")
+    assert cache.stats() == {
+        "entries": 1, "bytes": 30, "hits": 1, "misses": 1, "hit_rate": 0.5
+    }
+
+
+def main():
+    """Test MafStream."""
+    test_concat_blocks()
+    test_concat_blocks_bounded()
+    test_iterate_from_use_offset()
+    test_lru_cache()
+    print("MafStream OK")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,84 @@
+#!/usr/bin/python3
+"""Test RNAcodeResult against the line loop it replaced."""
+
+import os
+import random
+import tempfile
+import time
+
+from RNAcodeResult import load_results, read_results
+
+
+def random_results(rng, num_lines):
+    """Get random 'RNAcode -t' output."""
+    lines = []
+    for hss_id in range(num_lines):
+        start = rng.randrange(10**7)
+        length = rng.randrange(10, 300)
+        lines.append(
+            f"{hss_id}\t{rng.choice('+-')}\t{rng.randrange(1, 4)}\t{length}\t"
+            f"{rng.randrange(100)}\t{rng.randrange(100, 400)}\t"
+            f"hg38.chr{rng.randrange(1, 23)}_block-index_{rng.randrange(10**5)}\t"
+            f"{start}\t{start + length}\t{rng.uniform(0, 50):.3f}\t"
+            f"{rng.choice([1, 10**-rng.uniform(0, 6)]):.3g}\n"
+        )
+    return "".join(lines)
+
+
+def read_results_loop(result_file_path, p_threshold):
+    """Read a result file like build_bed did before RNAcodeResult."""
+    rnacode_res = []
+    with open(result_file_path, "r", encoding="UTF-8") as f_handle:
+        for line in f_handle.read().split("\n")[:-1]:
+            line = line.split("\t")
+            if float(line[-1]) > p_threshold:
+                continue
+            rnacode_res.append(line)
+    return rnacode_res
+
+
+def test_read_results():
+    """The table has the HSS and values of the line loop."""
+    rng = random.Random(17)
+    with tempfile.TemporaryDirectory() as tmp_dir:
+        result_file_paths = []
+        for i in range(5):
+            result_file_paths.append(os.path.join(tmp_dir, f"big_block_{i}.maf.res.tsv"))
+            with open(result_file_paths[-1], "w", encoding="UTF-8") as f_handle:
+                f_handle.write(random_results(rng, rng.randrange(0, 200)))
+        for p_threshold in (0.0001, 0.01, 1, float("inf")):
+            expected = []
+            for result_file_path in result_file_paths:
+                lines = read_results_loop(result_file_path, p_threshold)
+                results = read_results(result_file_path, p_threshold)
+                assert len(results) == len(lines)
+                for row, line in zip(results.tolist(), lines):
+                    assert [str(value) for value in row[:9]] == line[:9]
+                    assert row[9:] == (float(line[9]), float(line[10]))
+                expected += lines
+            results = load_results(result_file_paths, p_threshold)
+            assert results["hss_id"].tolist() == [int(line[0]) for line in expected]
+            assert results["name"].tolist() == [line[6] for line in expected]
+
+
+def compare_speed(num_lines=300_000, p_threshold=0.01):
+    """Print runtime of read_results and of the line loop."""
+    with tempfile.TemporaryDirectory() as tmp_dir:
+        result_file_path = os.path.join(tmp_dir, "big_block_1.maf.res.tsv")
+        with open(result_file_path, "w", encoding="UTF-8") as f_handle:
+            f_handle.write(random_results(random.Random(1), num_lines))
+        for name, read in (("line loop", read_results_loop), ("read_results", read_results)):
+            start_time = time.perf_counter()
+            read(result_file_path, p_threshold)
+            print(f"{name}: {time.perf_counter() - start_time:.2f} s for {num_lines} lines")
+
+
+def main():
+    """Test RNAcodeResult."""
+    test_read_results()
+    compare_speed()
+    print("RNAcodeResult OK")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,60 @@
+#!/usr/bin/python3
+"""Test build_segments against the quadratic build_segments_old."""
+
+import random
+
+from Segments import build_segments, build_segments_old
+
+
+def random_rnacode_res(rng, num_hss, chromosome_length):
+    """Get random RNAcode result lines with many overlaps."""
+    rnacode_res = []
+    for hss_id in range(num_hss):
+        start = rng.randrange(chromosome_length)
+        end = start + rng.randrange(1, 60)
+        p_val = rng.choice([0.0, 0.001, 0.005, 0.01, rng.random() / 100])
+        rnacode_res.append(
+            [
+                str(hss_id),
+                rng.choice(["+", "-"]),
+                str(rng.randrange(3)),
+                "0",
+                "0",
+                "0",
+                f"chr1_{rng.randrange(1, 1000)}_1",
+                str(start),
+                str(end),
+                "10.0",
+                str(p_val),
+            ]
+        )
+    return rnacode_res
+
+
+def test_build_segments_random():
+    """Compare with build_segments_old on HSS ordered by start."""
+    rng = random.Random(42)
+    for _ in range(300):
+        num_hss = rng.randrange(1, 200)
+        rnacode_res = random_rnacode_res(rng, num_hss, rng.choice([100, 1000, 10000]))
+        sorted_res = sorted(rnacode_res, key=lambda line: int(line[7]))
+        for only_best in (True, False):
+            assert build_segments(rnacode_res, "chr1", only_best) == build_segments_old(
+                sorted_res, "chr1", only_best
+            )
+
+
+def test_build_segments_empty():
+    """No HSS, no segments."""
+    assert build_segments([], "chr1") == []
+
+
+def main():
+    """Test build_segments."""
+    test_build_segments_random()
+    test_build_segments_empty()
+    print("build_segments OK")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,111 @@
+#!/usr/bin/python3
+"""Test the bed manifest and the result files of main."""
+
+import hashlib
+import importlib
+import json
+import os
+import tempfile
+
+import RNAcodeScheduler
+
+
+def import_main(tmp_dir):
+    """Import main with empty parameters in tmp_dir."""
+    with open(os.path.join(tmp_dir, "parameters_local.json"), "w", encoding="UTF-8") as f_handle:
+        json.dump(
+            {
+                "DATA_DIR": tmp_dir,
+                "DATA_DIR_OLD": tmp_dir,
+                "MULTIZ100WAY_WEB_FTP": "",
+                "MULTIZ20WAY_WEB_FTP": "",
+            },
+            f_handle,
+        )
+    cwd = os.getcwd()
+    os.chdir(tmp_dir)
+    try:
+        return importlib.import_module("main")
+    finally:
+        os.chdir(cwd)
+
+
+def test_get_bed_manifest():
+    """Checksums are computed for new results and reused for unchanged ones."""
+    with tempfile.TemporaryDirectory() as tmp_dir:
+        main = import_main(tmp_dir)
+        os.mkdir(os.path.join(tmp_dir, "big_blocks"))
+        res_path = os.path.join(tmp_dir, "big_blocks", "big_block_1.maf.res.tsv")
+        with open(res_path, "w", encoding="UTF-8") as f_handle:
+            f_handle.write("result\n")
+        manifest = main.get_bed_manifest(tmp_dir, {})
+        stat = os.stat(res_path)
+        assert manifest == {
+            "p_threshold": main.P_THRESHOLD,
+            "files": {
+                "big_block_1.maf.res.tsv": [
+                    stat.st_mtime_ns, stat.st_size, hashlib.md5(b"result\n").hexdigest()
+                ]
+            },
+        }
+        # An unchanged file keeps the checksum of the old manifest
+        manifest["files"]["big_block_1.maf.res.tsv"][2] = "old"
+        assert main.get_bed_manifest(tmp_dir, manifest) == manifest
+
+
+def write_files(dir_path, file_contents):
+    """Write files with their content into dir_path."""
+    for file_name, content in file_contents.items():
+        with open(os.path.join(dir_path, file_name), "w", encoding="UTF-8") as f_handle:
+            f_handle.write(content)
+
+
+def test_get_result_file_paths():
+    """Only results of the current big blocks and their single blocks are taken."""
+    with tempfile.TemporaryDirectory() as tmp_dir:
+        main = import_main(tmp_dir)
+        big_blocks_dir = os.path.join(tmp_dir, "big_blocks")
+        os.mkdir(big_blocks_dir)
+        write_files(
+            tmp_dir,
+            {
+                "big_block_costs.json": json.dumps({"big_block_1": 10, "big_block_2": 5}),
+                "big_blocks_state.json": json.dumps(
+                    {"big_block_2": {"status": "failed"}, "big_block_3": {"status": "failed"}}
+                ),
+            },
+        )
+        maf = "a score=0\ns hg38.chr1 0 2 + 100 AC\n\n"
+        write_files(
+            big_blocks_dir,
+            {
+                "big_block_1.maf.res.tsv": "",
+                "big_block_2.maf": maf * 2,
+                "big_block_2.maf.res.tsv": "",
+                # Left from an earlier packing
+                "big_block_3.maf.res.tsv": "",
+                "big_block_3-s_1.maf.res.tsv": "",
+                "big_block_2-s_3.maf": maf,
+                "big_block_2-s_3.maf.res.tsv": "",
+            },
+        )
+        single_block_paths = RNAcodeScheduler.build_single_blocks(tmp_dir, ["big_block_2"])
+        assert [os.path.basename(path) for path in single_block_paths] == [
+            "big_block_2-s_1.maf", "big_block_2-s_2.maf"
+        ]
+        assert not os.path.isfile(os.path.join(big_blocks_dir, "big_block_2-s_3.maf.res.tsv"))
+        write_files(big_blocks_dir, {"big_block_2-s_1.maf.res.tsv": ""})
+        assert [os.path.basename(path) for path in main.get_result_file_paths(tmp_dir)] == [
+            "big_block_1.maf.res.tsv", "big_block_2-s_1.maf.res.tsv", "big_block_2.maf.res.tsv"
+        ]
+
+
+def main():
+    """Test main."""
+    test_get_bed_manifest()
+    test_get_result_file_paths()
+    print("main OK")
+
+
+if __name__ == "__main__":
+    main()